@@ -0,0 +1,857 @@
+'''
+bitboard position core
+squares are numbered row * 8 + col, with row 0 being black's back rank,
+which matches the Board.board[row][col] layout used by the rest of the game
+'''
+
+import random
+from tables import BOARD_SIZE
+from tables import NUM_SQUARES
+from tables import RAYS
+from tables import RAY_MASKS
+from tables import INCREASING
+from tables import ROOK_DIRECTIONS
+from tables import BISHOP_DIRECTIONS
+from tables import KNIGHT_MASKS
+from tables import KING_MASKS
+from tables import PAWN_CAPTURE_MASKS
+
+WHITE = 0
+BLACK = 1
+COLORS = ("w", "b")
+
+PAWN = 0
+KNIGHT = 1
+BISHOP = 2
+ROOK = 3
+QUEEN = 4
+KING = 5
+PIECE_LETTERS = "pnbrqk"
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+
+ZOBRIST_SEED = 0x5EED
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+
+def square(row, col):
+    """
+    Converts a (row, col) pair into a square index.
+
+    :param row: The board row (0 is black's back rank).
+    :param col: The board column.
+    :return: The square index between 0 and 63.
+    """
+    return row * BOARD_SIZE + col
+
+
+def iter_bits(bb):
+    """
+    Yields the index of every set bit in a bitboard, lowest first.
+
+    :param bb: The bitboard to walk.
+    """
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+KNIGHT_ATTACKS = KNIGHT_MASKS
+KING_ATTACKS = KING_MASKS
+PAWN_ATTACKS = PAWN_CAPTURE_MASKS
+
+
+def sliding_attacks(sq, occupied, directions):
+    """
+    Generates the attack set of a sliding piece from the precomputed rays: each ray is
+    cut off behind its nearest blocker by removing the ray that starts at the blocker.
+
+    :param sq: The square the slider stands on.
+    :param occupied: Bitboard of every occupied square.
+    :param directions: The tables direction indices the slider moves along.
+    :return: A bitboard of attacked squares (blockers included).
+    """
+    attacks = 0
+    for direction in directions:
+        ray = RAY_MASKS[direction][sq]
+        blockers = ray & occupied
+        if blockers:
+            if INCREASING[direction]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAY_MASKS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+
+def bishop_attacks(sq, occupied):
+    return sliding_attacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+def rook_attacks(sq, occupied):
+    return sliding_attacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def queen_attacks(sq, occupied):
+    return bishop_attacks(sq, occupied) | rook_attacks(sq, occupied)
+
+
+# castling rights lost when a piece leaves or lands on these squares
+CASTLE_MASK = [ALL_CASTLING] * NUM_SQUARES
+CASTLE_MASK[square(7, 4)] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_MASK[square(7, 7)] &= ~WHITE_KINGSIDE
+CASTLE_MASK[square(7, 0)] &= ~WHITE_QUEENSIDE
+CASTLE_MASK[square(0, 4)] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_MASK[square(0, 7)] &= ~BLACK_KINGSIDE
+CASTLE_MASK[square(0, 0)] &= ~BLACK_QUEENSIDE
+
+# king destination -> (rook from, rook to)
+CASTLE_ROOKS = {
+    square(7, 6): (square(7, 7), square(7, 5)),
+    square(7, 2): (square(7, 0), square(7, 3)),
+    square(0, 6): (square(0, 7), square(0, 5)),
+    square(0, 2): (square(0, 0), square(0, 3)),
+}
+
+
+def _between_table():
+    """
+    Builds the table of squares strictly between two squares on a shared line.
+
+    :return: A 64x64 list of bitboards, zero where the squares are not aligned.
+    """
+    table = [[0] * NUM_SQUARES for _ in range(NUM_SQUARES)]
+    for rays in RAYS:
+        for sq in range(NUM_SQUARES):
+            between = 0
+            for target in rays[sq]:
+                table[sq][target] = between
+                between |= 1 << target
+    return table
+
+
+BETWEEN = _between_table()
+
+LIGHT_SQUARES = 0
+for _sq in range(NUM_SQUARES):
+    if sum(divmod(_sq, BOARD_SIZE)) % 2 == 0:
+        LIGHT_SQUARES |= 1 << _sq
+
+
+def _zobrist_tables():
+    """
+    Draws the random keys used for Zobrist hashing. The seed is fixed so every
+    process (server workers, clients) agrees on the key of a position.
+
+    :return: A tuple (piece keys indexed [color][type][square], side key, castling keys, en passant file keys).
+    """
+    rng = random.Random(ZOBRIST_SEED)
+    pieces = [[[rng.getrandbits(64) for _ in range(NUM_SQUARES)] for _ in range(6)] for _ in (WHITE, BLACK)]
+    side = rng.getrandbits(64)
+    castling = [rng.getrandbits(64) for _ in range(ALL_CASTLING + 1)]
+    ep = [rng.getrandbits(64) for _ in range(BOARD_SIZE)]
+    return pieces, side, castling, ep
+
+
+ZOBRIST_PIECES, ZOBRIST_SIDE, ZOBRIST_CASTLING, ZOBRIST_EP = _zobrist_tables()
+
+
+def piece_code(color, ptype):
+    """
+    Packs a piece into a 4-bit code: 0 is an empty square, 1-6 white pawn to king, 9-14 black.
+
+    :param color: WHITE or BLACK.
+    :param ptype: The piece type.
+    :return: The piece code.
+    """
+    return (color << 3) | (ptype + 1)
+
+
+PIECE_CODES = [[piece_code(color, ptype) for ptype in range(6)] for color in (WHITE, BLACK)]
+CASTLING_LETTERS = (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+
+
+def parse_fen(fen):
+    """
+    Parses a FEN string into the arguments of load_squares.
+
+    :param fen: The position in Forsyth-Edwards notation.
+    :return: A tuple (codes, turn, castling, ep, halfmove, fullmove).
+    """
+    fields = fen.split()
+    codes = bytearray(NUM_SQUARES)
+    row = col = 0
+    for ch in fields[0]:
+        if ch == "/":
+            row += 1
+            col = 0
+        elif ch.isdigit():
+            col += int(ch)
+        else:
+            color = WHITE if ch.isupper() else BLACK
+            codes[square(row, col)] = piece_code(color, PIECE_LETTERS.index(ch.lower()))
+            col += 1
+
+    turn = WHITE if len(fields) < 2 or fields[1] == "w" else BLACK
+    castling = 0
+    if len(fields) > 2:
+        for ch, right in CASTLING_LETTERS:
+            if ch in fields[2]:
+                castling |= right
+    ep = -1
+    if len(fields) > 3 and fields[3] != "-":
+        ep = square(8 - int(fields[3][1]), ord(fields[3][0]) - ord("a"))
+    halfmove = int(fields[4]) if len(fields) > 4 else 0
+    fullmove = int(fields[5]) if len(fields) > 5 else 1
+    return codes, turn, castling, ep, halfmove, fullmove
+
+
+def format_fen(codes, turn, castling, ep, halfmove, fullmove):
+    """
+    Formats a position given as 64 piece codes into a FEN string.
+
+    :return: The position in Forsyth-Edwards notation.
+    """
+    rows = []
+    for row in range(BOARD_SIZE):
+        text = ""
+        empty = 0
+        for col in range(BOARD_SIZE):
+            code = codes[square(row, col)]
+            if not code:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            letter = PIECE_LETTERS[(code & 7) - 1]
+            text += letter.upper() if code >> 3 == WHITE else letter
+        if empty:
+            text += str(empty)
+        rows.append(text)
+
+    rights = "".join(ch for ch, right in CASTLING_LETTERS if castling & right) or "-"
+    target = "-"
+    if ep != -1:
+        row, col = divmod(ep, BOARD_SIZE)
+        target = "abcdefgh"[col] + str(8 - row)
+    return " ".join(("/".join(rows), COLORS[turn], rights, target, str(halfmove), str(fullmove)))
+
+
+def encode_move(start, end, promotion=0):
+    """
+    Packs a move into a single int.
+
+    :param start: The origin square.
+    :param end: The destination square.
+    :param promotion: The piece type a pawn promotes to, or 0.
+    :return: The packed move.
+    """
+    return start | (end << 6) | (promotion << 12)
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_promotion(move):
+    return move >> 12
+
+
+class Position:
+    def __init__(self, fen=START_FEN):
+        """
+        Initializes a position from a FEN string.
+
+        :param fen: The position in Forsyth-Edwards notation. Defaults to the starting position.
+        """
+
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occupied = [0, 0]
+        self.all = 0
+        # the piece code of every square, kept in step with the bitboards
+        self.mailbox = bytearray(NUM_SQUARES)
+        self.turn = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        # undo records: (move, piece type, captured type or -1, captured square, castling, ep, halfmove, zobrist)
+        self.history = []
+        self.zobrist = 0
+        # attack maps: what each square's piece attacks, how many pieces of each
+        # color hit each square, and the union of squares each color attacks
+        self.attacks_from = [0] * NUM_SQUARES
+        self.attack_counts = [[0] * NUM_SQUARES, [0] * NUM_SQUARES]
+        self.attacked = [0, 0]
+        self.set_fen(fen)
+
+    def set_fen(self, fen):
+        """
+        Loads a FEN string into this position, replacing the current contents.
+
+        :param fen: The position in Forsyth-Edwards notation.
+        """
+        self.load_squares(*parse_fen(fen))
+
+    def reset(self):
+        """
+        Returns to the starting position in place. The bitboards, attack maps and key are
+        copied from a ready-made start position rather than recomputed, and no list is replaced.
+        """
+        start = _START_POSITION
+        for color in (WHITE, BLACK):
+            self.pieces[color][:] = start.pieces[color]
+            self.attack_counts[color][:] = start.attack_counts[color]
+        self.occupied[:] = start.occupied
+        self.attacked[:] = start.attacked
+        self.attacks_from[:] = start.attacks_from
+        self.mailbox[:] = start.mailbox
+        self.all = start.all
+        self.turn = start.turn
+        self.castling = start.castling
+        self.ep = start.ep
+        self.halfmove = start.halfmove
+        self.fullmove = start.fullmove
+        self.zobrist = start.zobrist
+        self.history.clear()
+
+    def _ep_zobrist(self):
+        """
+        Gives the en passant part of the hash. The file only counts when a pawn of the
+        side to move could actually capture, so otherwise identical positions repeat.
+
+        :return: The key to xor in, or 0.
+        """
+        if self.ep == -1 or not PAWN_ATTACKS[self.turn ^ 1][self.ep] & self.pieces[self.turn][PAWN]:
+            return 0
+        return ZOBRIST_EP[self.ep % BOARD_SIZE]
+
+    def _compute_zobrist(self):
+        """
+        Hashes the whole position from scratch. make_move keeps the key up to date afterwards.
+
+        :return: The 64-bit Zobrist key.
+        """
+        key = ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        if self.turn == BLACK:
+            key ^= ZOBRIST_SIDE
+        for color in (WHITE, BLACK):
+            for ptype in range(6):
+                for sq in iter_bits(self.pieces[color][ptype]):
+                    key ^= ZOBRIST_PIECES[color][ptype][sq]
+        return key
+
+    def squares(self):
+        """
+        Lists the piece code of every square (see piece_code).
+
+        :return: A bytearray of 64 codes.
+        """
+        return bytearray(self.mailbox)
+
+    def load_squares(self, codes, turn, castling, ep, halfmove, fullmove):
+        """
+        Replaces the position with one given as 64 piece codes plus the game state.
+        The undo stack is cleared.
+
+        :param codes: 64 piece codes (see piece_code).
+        :param turn: The side to move.
+        :param castling: The castling rights bitmask.
+        :param ep: The en passant square or -1.
+        :param halfmove: Plies since the last capture or pawn move.
+        :param fullmove: The move number.
+        """
+        for color in (WHITE, BLACK):
+            for ptype in range(6):
+                self.pieces[color][ptype] = 0
+        for sq, code in enumerate(codes):
+            if code:
+                self.pieces[code >> 3][(code & 7) - 1] |= 1 << sq
+        self.turn = turn
+        self.castling = castling
+        self.ep = ep
+        self.halfmove = halfmove
+        self.fullmove = fullmove
+        self.history = []
+        self._update_occupancy()
+        self._rebuild_attacks()
+        self.zobrist = self._compute_zobrist()
+
+    def fen(self):
+        """
+        Serializes the position to a FEN string.
+
+        :return: The position in Forsyth-Edwards notation.
+        """
+        return format_fen(self.mailbox, self.turn, self.castling, self.ep, self.halfmove, self.fullmove)
+
+    def _update_occupancy(self):
+        for color in (WHITE, BLACK):
+            occ = 0
+            for ptype, bb in enumerate(self.pieces[color]):
+                occ |= bb
+                for sq in iter_bits(bb):
+                    self.mailbox[sq] = PIECE_CODES[color][ptype]
+            self.occupied[color] = occ
+        self.all = self.occupied[WHITE] | self.occupied[BLACK]
+        for sq in iter_bits(~self.all & FULL):
+            self.mailbox[sq] = 0
+
+    def _piece_attacks(self, sq):
+        """
+        Computes the squares attacked by the piece on a square with the current occupancy.
+
+        :param sq: The square index.
+        :return: A (color, attacks) tuple, or None if the square is empty.
+        """
+        piece = self.piece_at(sq)
+        if piece is None:
+            return None
+        color, ptype = piece
+        if ptype == PAWN:
+            return color, PAWN_ATTACKS[color][sq]
+        if ptype == KNIGHT:
+            return color, KNIGHT_ATTACKS[sq]
+        if ptype == BISHOP:
+            return color, bishop_attacks(sq, self.all)
+        if ptype == ROOK:
+            return color, rook_attacks(sq, self.all)
+        if ptype == QUEEN:
+            return color, queen_attacks(sq, self.all)
+        return color, KING_ATTACKS[sq]
+
+    def _add_attacks(self, color, bb):
+        counts = self.attack_counts[color]
+        for sq in iter_bits(bb):
+            counts[sq] += 1
+        self.attacked[color] |= bb
+
+    def _remove_attacks(self, color, bb):
+        counts = self.attack_counts[color]
+        for sq in iter_bits(bb):
+            counts[sq] -= 1
+            if not counts[sq]:
+                self.attacked[color] &= ~(1 << sq)
+
+    def _rebuild_attacks(self):
+        """
+        Recomputes every attack map from scratch. Only needed when a whole position is loaded.
+        """
+        self.attacks_from = [0] * NUM_SQUARES
+        self.attack_counts = [[0] * NUM_SQUARES, [0] * NUM_SQUARES]
+        self.attacked = [0, 0]
+        for sq in iter_bits(self.all):
+            color, attacks = self._piece_attacks(sq)
+            self.attacks_from[sq] = attacks
+            self._add_attacks(color, attacks)
+
+    def _detach_attacks(self, touched):
+        """
+        Removes the attacks of the pieces on the squares a move is about to change,
+        and finds the sliders whose rays run into those squares.
+
+        :param touched: Bitboard of squares whose contents are about to change.
+        :return: A bitboard of the sliders that need their rays recomputed afterwards.
+        """
+        for sq in iter_bits(touched & self.all):
+            color = WHITE if self.occupied[WHITE] & (1 << sq) else BLACK
+            self._remove_attacks(color, self.attacks_from[sq])
+            self.attacks_from[sq] = 0
+
+        sliders = 0
+        for color in (WHITE, BLACK):
+            p = self.pieces[color]
+            for sq in iter_bits((p[BISHOP] | p[ROOK] | p[QUEEN]) & ~touched):
+                if self.attacks_from[sq] & touched:
+                    sliders |= 1 << sq
+        return sliders
+
+    def _attach_attacks(self, touched, sliders):
+        """
+        Adds the attacks of the pieces now standing on the changed squares and
+        updates the rays of the sliders found by _detach_attacks.
+
+        :param touched: Bitboard of squares whose contents changed.
+        :param sliders: Bitboard returned by _detach_attacks.
+        """
+        for sq in iter_bits(touched & self.all):
+            color, attacks = self._piece_attacks(sq)
+            self.attacks_from[sq] = attacks
+            self._add_attacks(color, attacks)
+
+        for sq in iter_bits(sliders):
+            color, attacks = self._piece_attacks(sq)
+            old = self.attacks_from[sq]
+            self.attacks_from[sq] = attacks
+            self._remove_attacks(color, old & ~attacks)
+            self._add_attacks(color, attacks & ~old)
+
+    def piece_at(self, sq):
+        """
+        Looks up the piece standing on a square.
+
+        :param sq: The square index.
+        :return: A (color, piece type) tuple, or None if the square is empty.
+        """
+        code = self.mailbox[sq]
+        if not code:
+            return None
+        return code >> 3, (code & 7) - 1
+
+    def king_square(self, color):
+        """
+        Finds the king of the given color.
+
+        :param color: WHITE or BLACK.
+        :return: The king's square index, or -1 if there is no king.
+        """
+        return self.pieces[color][KING].bit_length() - 1
+
+    def attackers_to(self, sq, by, occupied=None):
+        """
+        Collects every piece of one color that attacks a square.
+
+        :param sq: The target square.
+        :param by: The attacking color.
+        :param occupied: Occupancy to use for sliding pieces. Defaults to the current board.
+        :return: A bitboard of attacking pieces.
+        """
+        if occupied is None:
+            occupied = self.all
+        p = self.pieces[by]
+        return ((PAWN_ATTACKS[by ^ 1][sq] & p[PAWN])
+                | (KNIGHT_ATTACKS[sq] & p[KNIGHT])
+                | (KING_ATTACKS[sq] & p[KING])
+                | (bishop_attacks(sq, occupied) & (p[BISHOP] | p[QUEEN]))
+                | (rook_attacks(sq, occupied) & (p[ROOK] | p[QUEEN])))
+
+    def is_attacked(self, sq, by):
+        """
+        Checks whether a square is attacked by a color using the incremental attack maps.
+
+        :param sq: The target square.
+        :param by: The attacking color.
+        :return: True if any piece of that color attacks the square.
+        """
+        return (self.attacked[by] >> sq) & 1 == 1
+
+    def in_check(self, color):
+        """
+        Checks whether a color's king is attacked.
+
+        :param color: WHITE or BLACK.
+        :return: True if the king is in check.
+        """
+        king = self.king_square(color)
+        return king >= 0 and self.is_attacked(king, color ^ 1)
+
+    def key(self):
+        """
+        Identifies the position: placement, side to move, castling rights and en passant square.
+
+        :return: The 64-bit Zobrist key.
+        """
+        return self.zobrist
+
+    def insufficient_material(self):
+        """
+        Checks whether neither side can possibly deliver mate: bare kings, a single
+        minor piece, or only bishops that all stand on the same square color.
+
+        :return: True if the position is a dead draw.
+        """
+        w = self.pieces[WHITE]
+        b = self.pieces[BLACK]
+        if w[PAWN] | b[PAWN] | w[ROOK] | b[ROOK] | w[QUEEN] | b[QUEEN]:
+            return False
+        minors = w[KNIGHT] | b[KNIGHT] | w[BISHOP] | b[BISHOP]
+        if not minors & (minors - 1):
+            return True
+        if w[KNIGHT] | b[KNIGHT]:
+            return False
+        bishops = w[BISHOP] | b[BISHOP]
+        return not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES
+
+    def attack_set(self, color):
+        """
+        Returns the union of every square attacked by a color.
+
+        :param color: WHITE or BLACK.
+        :return: A bitboard of attacked squares.
+        """
+        return self.attacked[color]
+
+    def _pins(self, color, king):
+        """
+        Finds the pieces of a color that are pinned to their king.
+
+        :param color: The side whose pieces may be pinned.
+        :param king: That side's king square.
+        :return: A dict mapping each pinned piece's square to the squares it may still move to.
+        """
+        enemy = self.pieces[color ^ 1]
+        enemy_occ = self.occupied[color ^ 1]
+        snipers = ((rook_attacks(king, enemy_occ) & (enemy[ROOK] | enemy[QUEEN]))
+                   | (bishop_attacks(king, enemy_occ) & (enemy[BISHOP] | enemy[QUEEN])))
+        pins = {}
+        for sq in iter_bits(snipers):
+            blockers = BETWEEN[king][sq] & self.all
+            if blockers and not blockers & (blockers - 1) and blockers & self.occupied[color]:
+                pins[blockers.bit_length() - 1] = BETWEEN[king][sq] | (1 << sq)
+        return pins
+
+    def legal_moves(self, from_mask=FULL):
+        """
+        Generates the strictly legal moves of the side to move.
+
+        :param from_mask: Bitboard restricting which origin squares to generate for. Defaults to all.
+        :return: A list of packed moves.
+        """
+        return list(self.iter_legal_moves(from_mask))
+
+    def has_legal_move(self):
+        """
+        Checks whether the side to move has any legal move, stopping at the first one found.
+
+        :return: True if at least one legal move exists.
+        """
+        for _ in self.iter_legal_moves():
+            return True
+        return False
+
+    def iter_legal_moves(self, from_mask=FULL):
+        """
+        Lazily yields the strictly legal moves of the side to move. Pins and checks are
+        computed once, then each piece's targets are masked by them. King moves come first
+        so that callers that stop early usually do so before pins are computed.
+
+        :param from_mask: Bitboard restricting which origin squares to generate for. Defaults to all.
+        """
+        us = self.turn
+        them = us ^ 1
+        p = self.pieces[us]
+        enemy = self.pieces[them]
+        own = self.occupied[us]
+        king = self.king_square(us)
+        checkers = self.attackers_to(king, them)
+
+        if from_mask & (1 << king):
+            # sliders giving check keep attacking the squares behind the king
+            danger = self.attacked[them]
+            occ = self.all ^ (1 << king)
+            for sq in iter_bits(checkers & (enemy[BISHOP] | enemy[QUEEN])):
+                danger |= bishop_attacks(sq, occ)
+            for sq in iter_bits(checkers & (enemy[ROOK] | enemy[QUEEN])):
+                danger |= rook_attacks(sq, occ)
+            for to in iter_bits(KING_ATTACKS[king] & ~own & ~danger):
+                yield encode_move(king, to)
+            if not checkers:
+                yield from self._castling_moves(us, king)
+
+        if checkers & (checkers - 1):
+            return
+
+        check_mask = FULL
+        if checkers:
+            check_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]
+        pins = self._pins(us, king)
+
+        step = -BOARD_SIZE if us == WHITE else BOARD_SIZE
+        start_row = 6 if us == WHITE else 1
+        for sq in iter_bits(p[PAWN] & from_mask):
+            targets = PAWN_ATTACKS[us][sq] & self.occupied[them]
+            one = sq + step
+            if not (self.all >> one) & 1:
+                targets |= 1 << one
+                if sq // BOARD_SIZE == start_row and not (self.all >> (one + step)) & 1:
+                    targets |= 1 << (one + step)
+            for to in iter_bits(targets & check_mask & pins.get(sq, FULL)):
+                if to // BOARD_SIZE in (0, 7):
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        yield encode_move(sq, to, promotion)
+                else:
+                    yield encode_move(sq, to)
+            if self.ep != -1 and (PAWN_ATTACKS[us][sq] >> self.ep) & 1:
+                # en passant removes two pieces from one rank, so just try it
+                move = encode_move(sq, self.ep)
+                self.make_move(move)
+                legal = not self.in_check(us)
+                self.unmake_move()
+                if legal:
+                    yield move
+
+        for sq in iter_bits((p[KNIGHT] | p[BISHOP] | p[ROOK] | p[QUEEN]) & from_mask):
+            for to in iter_bits(self.attacks_from[sq] & ~own & check_mask & pins.get(sq, FULL)):
+                yield encode_move(sq, to)
+
+    def _castling_moves(self, color, king):
+        """
+        Generates castling moves, checking emptiness and that the king never crosses an attacked square.
+
+        :param color: The castling side.
+        :param king: The king's square.
+        :return: A list of packed castling moves.
+        """
+        row = 7 if color == WHITE else 0
+        if king != square(row, 4):
+            return []
+        kingside = WHITE_KINGSIDE if color == WHITE else BLACK_KINGSIDE
+        queenside = WHITE_QUEENSIDE if color == WHITE else BLACK_QUEENSIDE
+        them = color ^ 1
+        moves = []
+        if self.castling & (kingside | queenside) and not self.is_attacked(king, them):
+            if (self.castling & kingside
+                    and not self.all & ((1 << (king + 1)) | (1 << (king + 2)))
+                    and not self.is_attacked(king + 1, them)
+                    and not self.is_attacked(king + 2, them)):
+                moves.append(encode_move(king, king + 2))
+            if (self.castling & queenside
+                    and not self.all & ((1 << (king - 1)) | (1 << (king - 2)) | (1 << (king - 3)))
+                    and not self.is_attacked(king - 1, them)
+                    and not self.is_attacked(king - 2, them)):
+                moves.append(encode_move(king, king - 2))
+        return moves
+
+    def make_move(self, move):
+        """
+        Plays a move on the position without any legality check and pushes
+        everything needed to take it back onto the undo stack.
+
+        :param move: The packed move.
+        :return: The list of squares whose contents changed.
+        """
+        start = move_from(move)
+        end = move_to(move)
+        promotion = move_promotion(move)
+        us = self.turn
+        them = us ^ 1
+        mailbox = self.mailbox
+        ptype = (mailbox[start] & 7) - 1
+        start_bit = 1 << start
+        end_bit = 1 << end
+        changed = [start, end]
+
+        captured = -1
+        captured_sq = end
+        if self.occupied[them] & end_bit:
+            captured = (mailbox[end] & 7) - 1
+        elif ptype == PAWN and end == self.ep:
+            captured = PAWN
+            captured_sq = end + BOARD_SIZE if us == WHITE else end - BOARD_SIZE
+            changed.append(captured_sq)
+
+        self.history.append((move, ptype, captured, captured_sq, self.castling, self.ep, self.halfmove, self.zobrist))
+        zobrist = self.zobrist ^ ZOBRIST_SIDE ^ ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        table = ZOBRIST_PIECES[us]
+
+        castle = CASTLE_ROOKS[end] if ptype == KING and abs(end - start) == 2 else None
+        touched = start_bit | end_bit | (1 << captured_sq)
+        if castle:
+            touched |= (1 << castle[0]) | (1 << castle[1])
+        sliders = self._detach_attacks(touched)
+
+        if captured != -1:
+            captured_bit = 1 << captured_sq
+            self.pieces[them][captured] ^= captured_bit
+            self.occupied[them] ^= captured_bit
+            mailbox[captured_sq] = 0
+            zobrist ^= ZOBRIST_PIECES[them][captured][captured_sq]
+
+        zobrist ^= table[ptype][start] ^ table[promotion or ptype][end]
+        self.pieces[us][ptype] ^= start_bit
+        self.pieces[us][promotion or ptype] |= end_bit
+        self.occupied[us] ^= start_bit | end_bit
+        mailbox[start] = 0
+        mailbox[end] = PIECE_CODES[us][promotion or ptype]
+
+        if castle:
+            rook_bits = (1 << castle[0]) | (1 << castle[1])
+            self.pieces[us][ROOK] ^= rook_bits
+            self.occupied[us] ^= rook_bits
+            mailbox[castle[0]] = 0
+            mailbox[castle[1]] = PIECE_CODES[us][ROOK]
+            changed.extend(castle)
+            zobrist ^= table[ROOK][castle[0]] ^ table[ROOK][castle[1]]
+
+        self.all = self.occupied[WHITE] | self.occupied[BLACK]
+        self._attach_attacks(touched, sliders)
+        self.castling &= CASTLE_MASK[start] & CASTLE_MASK[end]
+        self.ep = (start + end) // 2 if ptype == PAWN and abs(end - start) == 2 * BOARD_SIZE else -1
+        if ptype == PAWN or captured != -1:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if us == BLACK:
+            self.fullmove += 1
+        self.turn = them
+        self.zobrist = zobrist ^ ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        return changed
+
+    def unmake_move(self):
+        """
+        Takes back the last move played with make_move.
+
+        :return: The list of squares whose contents changed.
+        """
+        move, ptype, captured, captured_sq, self.castling, self.ep, self.halfmove, self.zobrist = self.history.pop()
+        start = move_from(move)
+        end = move_to(move)
+        promotion = move_promotion(move)
+        self.turn ^= 1
+        us = self.turn
+        them = us ^ 1
+        start_bit = 1 << start
+        end_bit = 1 << end
+        changed = [start, end]
+
+        castle = CASTLE_ROOKS[end] if ptype == KING and abs(end - start) == 2 else None
+        touched = start_bit | end_bit | (1 << captured_sq)
+        if castle:
+            touched |= (1 << castle[0]) | (1 << castle[1])
+        sliders = self._detach_attacks(touched)
+
+        mailbox = self.mailbox
+        self.pieces[us][promotion or ptype] ^= end_bit
+        self.pieces[us][ptype] |= start_bit
+        self.occupied[us] ^= start_bit | end_bit
+        mailbox[end] = 0
+        mailbox[start] = PIECE_CODES[us][ptype]
+
+        if castle:
+            rook_bits = (1 << castle[0]) | (1 << castle[1])
+            self.pieces[us][ROOK] ^= rook_bits
+            self.occupied[us] ^= rook_bits
+            mailbox[castle[1]] = 0
+            mailbox[castle[0]] = PIECE_CODES[us][ROOK]
+            changed.extend(castle)
+
+        if captured != -1:
+            captured_bit = 1 << captured_sq
+            self.pieces[them][captured] |= captured_bit
+            self.occupied[them] |= captured_bit
+            mailbox[captured_sq] = PIECE_CODES[them][captured]
+            if captured_sq != end:
+                changed.append(captured_sq)
+
+        self.all = self.occupied[WHITE] | self.occupied[BLACK]
+        self._attach_attacks(touched, sliders)
+        if us == BLACK:
+            self.fullmove -= 1
+        return changed
+
+
+# copied by Position.reset, never modified
+_START_POSITION = Position()
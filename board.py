@@ -4,98 +4,182 @@ from piece import Rook
 from piece import Pawn
 from piece import Queen
 from piece import Knight
-import time
-import pygame
-
-MAX_TIME = 900
+from bitboard import Position
+from bitboard import COLORS
+from bitboard import WHITE
+from bitboard import BLACK
+from bitboard import KING
+from bitboard import ROOK
+from bitboard import QUEEN
+from bitboard import iter_bits
+from bitboard import square
+from bitboard import move_from
+from bitboard import move_to
+from bitboard import move_promotion
+from x88 import MailboxPosition
+from movecache import move_cache
+from clock import GameClock
+from clock import MAX_TIME
+
+FIFTY_MOVE_PLIES = 100
+REPETITION_LIMIT = 3
 BOARD_DIMENSION = 8
-X_COORDINATE = 113
-Y_COORDINATE = 113
-BOARD_WIDTH = 525
-BOARD_HEIGHT = 525
+# idle boards a BoardPool keeps by default
+BOARD_POOL_CAPACITY = 64
+
+# indexed by the bitboard piece type
+PIECE_CLASSES = (Pawn, Knight, Bishop, Rook, Queen, King)
+
+# interchangeable position implementations, both speak the same interface
+BACKENDS = {
+    "bitboard": Position,
+    "mailbox": MailboxPosition,
+}
+DEFAULT_BACKEND = "bitboard"
 
 class Board:
-    rect = (X_COORDINATE,Y_COORDINATE,BOARD_WIDTH,BOARD_HEIGHT)
-    startX = rect[0]
-    startY = rect[1]
-    def __init__(self, rows, cols):
+    def __init__(self, rows, cols, backend=DEFAULT_BACKEND, time_control=MAX_TIME):
         """
         Initializes the chess board with pieces and default settings.
         
         :param rows: The number of rows in the board.
         :param cols: The number of columns in the board.
+        :param backend: Name of the position implementation from BACKENDS. Defaults to bitboards.
+        :param time_control: Seconds on each player's clock.
         """
     
         self.rows = rows
         self.cols = cols
 
+        self.backend = backend
+        self.position = BACKENDS[backend]()
+
+        # started by the server once both players are seated
+        self.clock = GameClock(time_control)
+
+        # occurrences of each position since the last capture or pawn move
+        self.repetitions = {}
+
+        self.reset()
+
+    def reset(self, time_control=None):
+        """
+        Puts the board back to the start of a new game in place, keeping its position,
+        clock and tables, so a finished game's board can be reused by the next one.
+
+        :param time_control: Seconds on each player's clock, or None to keep the current time control.
+        """
+
         self.ready = False
 
         self.last = None
 
         self.copy = True
 
-        self.board = [[0 for x in range(BOARD_DIMENSION)] for _ in range(rows)]
-
-        self.board[0][0] = Rook(0, 0, "b")
-        self.board[0][1] = Knight(0, 1, "b")
-        self.board[0][2] = Bishop(0, 2, "b")
-        self.board[0][3] = Queen(0, 3, "b")
-        self.board[0][4] = King(0, 4, "b")
-        self.board[0][5] = Bishop(0, 5, "b")
-        self.board[0][6] = Knight(0, 6, "b")
-        self.board[0][7] = Rook(0, 7, "b")
-
-        self.board[1][0] = Pawn(1, 0, "b")
-        self.board[1][1] = Pawn(1, 1, "b")
-        self.board[1][2] = Pawn(1, 2, "b")
-        self.board[1][3] = Pawn(1, 3, "b")
-        self.board[1][4] = Pawn(1, 4, "b")
-        self.board[1][5] = Pawn(1, 5, "b")
-        self.board[1][6] = Pawn(1, 6, "b")
-        self.board[1][7] = Pawn(1, 7, "b")
-
-        self.board[7][0] = Rook(7, 0, "w")
-        self.board[7][1] = Knight(7, 1, "w")
-        self.board[7][2] = Bishop(7, 2, "w")
-        self.board[7][3] = Queen(7, 3, "w")
-        self.board[7][4] = King(7, 4, "w")
-        self.board[7][5] = Bishop(7, 5, "w")
-        self.board[7][6] = Knight(7, 6, "w")
-        self.board[7][7] = Rook(7, 7, "w")
-
-        self.board[6][0] = Pawn(6, 0, "w")
-        self.board[6][1] = Pawn(6, 1, "w")
-        self.board[6][2] = Pawn(6, 2, "w")
-        self.board[6][3] = Pawn(6, 3, "w")
-        self.board[6][4] = Pawn(6, 4, "w")
-        self.board[6][5] = Pawn(6, 5, "w")
-        self.board[6][6] = Pawn(6, 6, "w")
-        self.board[6][7] = Pawn(6, 7, "w")
+        self.position.reset()
+        self.selected = None
+
+        # Piece objects for rendering, only built when something reads self.board
+        self._view = None
 
         self.p1Name = "Player 1"
         self.p2Name = "Player 2"
 
         self.turn = "w"
 
-        self.time1 = MAX_TIME
-        self.time2 = MAX_TIME
-
-        self.storedTime1 = 0
-        self.storedTime2 = 0
+        self.clock.reset(time_control)
 
         self.winner = None
+        self.result = None
+        self.repetitions.clear()
+        self.repetitions[self.position.key()] = 1
+
+        # bumped on every change clients need to see; deltas are computed against it
+        self.version = 0
+        self.move_version = 0
+        self.prev_move_version = 0
+        self.names_version = 0
+        self.last_move = None
+
+    @property
+    def time1(self):
+        """
+        White's time left in seconds, counted down from the clock without any messages.
+        """
+        return self.clock.left(WHITE)
+
+    @property
+    def time2(self):
+        """
+        Black's time left in seconds, counted down from the clock without any messages.
+        """
+        return self.clock.left(BLACK)
+
+    @property
+    def board(self):
+        """
+        The 8x8 grid of Piece objects (0 for empty squares) used for rendering. The server
+        never reads it, so it is built from the position's piece codes on first access.
+
+        :return: A list of rows.
+        """
+        if self._view is None:
+            self.refresh_view()
+        return self._view
+
+    def _refresh_square(self, sq):
+        """
+        Rebuilds the rendering view of one square from the piece codes, if the view exists.
+
+        :param sq: The square index that changed.
+        """
+        if self._view is None:
+            return
+        row, col = divmod(sq, self.cols)
+        piece = self.position.piece_at(sq)
+        if piece:
+            self._view[row][col] = PIECE_CLASSES[piece[1]](row, col, COLORS[piece[0]])
+        else:
+            self._view[row][col] = 0
+
+    def show_selected(self):
+        """
+        Highlights the selected piece in the rendering view, if the view exists.
+        """
+        if self._view is not None and self.selected is not None:
+            row, col = divmod(self.selected, self.cols)
+            if self._view[row][col] != 0:
+                self._view[row][col].selected = True
 
-        self.startTime = time.time()
+    def refresh_view(self):
+        """
+        Rebuilds the whole rendering view from the position, including the selection highlight.
+        """
+        self._view = [[0 for x in range(BOARD_DIMENSION)] for _ in range(self.rows)]
+        for sq in range(self.rows * self.cols):
+            self._refresh_square(sq)
+        self.show_selected()
 
     def update_moves(self):
         """
-        Updates the valid move lists for all pieces on the board.
+        Updates the move list of the selected piece with its legal moves.
+        Other pieces are only a rendering view and keep an empty list, and
+        nothing is done while the view has not been built.
         """
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    self.board[i][j].update_valid_moves(self.board)
+        if self.selected is None or self._view is None:
+            return
+        row, col = divmod(self.selected, self.cols)
+        targets = {divmod(move_to(m), self.cols) for m in self.legal_moves() if move_from(m) == self.selected}
+        self.board[row][col].move_list = [(c, r) for r, c in targets]
+
+    def legal_moves(self):
+        """
+        Looks up the legal moves of the side to move in the process-wide move cache,
+        so positions seen before (openings, repeated polling) are not generated again.
+
+        :return: A tuple of packed moves.
+        """
+        return move_cache.moves(self.position)
 
     def draw(self, win, color):
         """
@@ -104,40 +188,22 @@ class Board:
         :param win: The Pygame surface where the board is drawn.
         :param color: The current player's color ('w' or 'b').
         """
-        if self.last and color == self.turn:
-            y, x = self.last[0]
-            y1, x1 = self.last[1]
-
-            xx = (4 - x) +round(self.startX + (x * self.rect[2] / BOARD_DIMENSION))
-            yy = 3 + round(self.startY + (y * self.rect[3] / BOARD_DIMENSION))
-            pygame.draw.circle(win, (0,0,255), (xx+32, yy+30), 34, 4)
-            xx1 = (4 - x) + round(self.startX + (x1 * self.rect[2] / BOARD_DIMENSION))
-            yy1 = 3+ round(self.startY + (y1 * self.rect[3] / BOARD_DIMENSION))
-            pygame.draw.circle(win, (0, 0, 255), (xx1 + 32, yy1 + 30), 34, 4)
-
-        s = None
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    self.board[i][j].draw(win, color)
-                    if self.board[i][j].isSelected:
-                        s = (i, j)
-
+        # imported here so the server never loads pygame
+        from render import draw_board
+        draw_board(win, self, color)
 
     def get_danger_moves(self, color):
         """
         Retrieves a list of all squares that are threatened by the opponent.
         
         :param color: The color of the player ('w' or 'b').
-        :return: A list of tuples representing positions that are under attack.
+        :return: A list of (col, row) tuples representing positions that are under attack.
         """
+        them = COLORS.index(color) ^ 1
         danger_moves = []
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    if self.board[i][j].color != color:
-                        for move in self.board[i][j].move_list:
-                            danger_moves.append(move)
+        for sq in iter_bits(move_cache.attacks(self.position)[them]):
+            row, col = divmod(sq, self.cols)
+            danger_moves.append((col, row))
 
         return danger_moves
 
@@ -148,19 +214,71 @@ class Board:
         :param color: The color of the player ('w' or 'b').
         :return: True if the king is in check, False otherwise.
         """
-        self.update_moves()
-        danger_moves = self.get_danger_moves(color)
-        king_pos = (-1, -1)
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    if self.board[i][j].king and self.board[i][j].color == color:
-                        king_pos = (j, i)
+        return self.position.in_check(COLORS.index(color))
+
+    def check_mate(self, color):
+        """
+        Determines if the player is checkmated.
+
+        :param color: The color of the player ('w' or 'b').
+        :return: True if it is that player's turn, their king is in check and they have no legal move.
+        """
+        side = COLORS.index(color)
+        return self.position.turn == side and self.position.in_check(side) and not self.position.has_legal_move()
+
+    def stale_mate(self, color):
+        """
+        Determines if the player is stalemated.
 
-        if king_pos in danger_moves:
-            return True
+        :param color: The color of the player ('w' or 'b').
+        :return: True if it is that player's turn, they are not in check and they have no legal move.
+        """
+        side = COLORS.index(color)
+        return self.position.turn == side and not self.position.in_check(side) and not self.position.has_legal_move()
+
+    def update_result(self):
+        """
+        Decides whether the game is over after a move and publishes the outcome in
+        self.result and self.winner ('w', 'b', or 'd' for a draw).
+        """
+        position = self.position
+        # only whether a move exists matters here, so stop at the first one found
+        if not position.has_legal_move():
+            if position.in_check(position.turn):
+                self.result = "checkmate"
+                self.winner = COLORS[position.turn ^ 1]
+            else:
+                self.result = "stalemate"
+                self.winner = "d"
+        elif position.insufficient_material():
+            self.result = "insufficient material"
+            self.winner = "d"
+        elif self.repetitions[position.key()] >= REPETITION_LIMIT:
+            self.result = "threefold repetition"
+            self.winner = "d"
+        elif position.halfmove >= FIFTY_MOVE_PLIES:
+            self.result = "fifty-move rule"
+            self.winner = "d"
+
+        if self.result:
+            self.clock.stop()
+            print("[GAME] Game over by", self.result)
+
+    def flag_fall(self):
+        """
+        Ends the game on time if the side whose clock is running has none left.
 
-        return False
+        :return: True if this call ended the game.
+        """
+        running = self.clock.running
+        if running is None or self.winner or self.clock.left(running) > 0:
+            return False
+        self.clock.stop()
+        self.result = "timeout"
+        self.winner = COLORS[running ^ 1]
+        self.touch()
+        print("[GAME] Game over by", self.result)
+        return True
 
     def select(self, col, row, color):
         """
@@ -170,125 +288,184 @@ class Board:
         :param row: The row index of the selected piece.
         :param color: The color of the player making the move ('w' or 'b').
         """
+        if not self.ready or self.winner or color != self.turn or not (0 <= row < self.rows and 0 <= col < self.cols):
+            return
+
         changed = False
-        prev = (-1, -1)
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    if self.board[i][j].selected:
-                        prev = (i, j)
-
-        # if piece
-        if self.board[row][col] == 0 and prev!=(-1,-1):
-            moves = self.board[prev[0]][prev[1]].move_list
-            if (col, row) in moves:
-                changed = self.move(prev, (row, col), color)
+        selected_before = self.selected
+        sq = square(row, col)
+        piece = self.position.piece_at(sq)
+        own = piece is not None and COLORS[piece[0]] == color
 
-        else:
-            if prev == (-1,-1):
+        if self.selected is None or (own and sq == self.selected):
+            self.reset_selected()
+            if own:
+                self.selected = sq
+                self.show_selected()
+
+        elif own:
+            prev = divmod(self.selected, self.cols)
+            # castling by clicking the rook and then the king
+            if self.position.piece_at(self.selected)[1] == ROOK and piece[1] == KING:
+                step = 2 if prev[1] > col else -2
+                changed = self.move((row, col), (row, col + step), color)
+
+            if not changed:
                 self.reset_selected()
-                if self.board[row][col] != 0:
-                    self.board[row][col].selected = True
-            else:
-                if self.board[prev[0]][prev[1]].color != self.board[row][col].color:
-                    moves = self.board[prev[0]][prev[1]].move_list
-                    if (col, row) in moves:
-                        changed = self.move(prev, (row, col), color)
-
-                    if self.board[row][col].color == color:
-                        self.board[row][col].selected = True
-
-                else:
-                    if self.board[row][col].color == color:
-                        #castling
-                        self.reset_selected()
-                        if self.board[prev[0]][prev[1]].moved == False and self.board[prev[0]][prev[1]].rook and self.board[row][col].king and col != prev[1] and prev!=(-1,-1):
-                            castle = True
-                            if prev[1] < col:
-                                for j in range(prev[1]+1, col):
-                                    if self.board[row][j] != 0:
-                                        castle = False
-
-                                if castle:
-                                    changed = self.move(prev, (row, 3), color)
-                                    changed = self.move((row,col), (row, 2), color)
-                                if not changed:
-                                    self.board[row][col].selected = True
-
-                            else:
-                                for j in range(col+1,prev[1]):
-                                    if self.board[row][j] != 0:
-                                        castle = False
-
-                                if castle:
-                                    changed = self.move(prev, (row, 6), color)
-                                    changed = self.move((row,col), (row, 5), color)
-                                if not changed:
-                                    self.board[row][col].selected = True
-                            
-                        else:
-                            self.board[row][col].selected = True
+                self.selected = sq
+                self.show_selected()
+
+        else:
+            prev = divmod(self.selected, self.cols)
+            changed = self.move(prev, (row, col), color)
 
         if changed:
-            if self.turn == "w":
-                self.turn = "b"
-                self.reset_selected()
-            else:
-                self.turn = "w"
-                self.reset_selected()
+            self.reset_selected()
+            self.update_result()
+        elif self.selected != selected_before:
+            self.touch()
 
     def reset_selected(self):
         """
         Deselects all pieces on the board.
         """
-        for i in range(self.rows):
-            for j in range(self.cols):
-                if self.board[i][j] != 0:
-                    self.board[i][j].selected = False
+        if self._view is not None and self.selected is not None:
+            row, col = divmod(self.selected, self.cols)
+            if self._view[row][col] != 0:
+                self._view[row][col].selected = False
+        self.selected = None
 
     def move(self, start, end, color):
         """
         Moves a piece from the start position to the end position if the move is valid.
+        Pawns reaching the last rank are promoted to a queen.
         
         :param start: A tuple (row, col) representing the starting position.
         :param end: A tuple (row, col) representing the destination position.
         :param color: The color of the player making the move ('w' or 'b').
         :return: True if the move was successful, False otherwise.
         """
-        checkedBefore = self.is_checked(color)
-        changed = True
-        nBoard = self.board[:]
-        if nBoard[start[0]][start[1]].pawn:
-            nBoard[start[0]][start[1]].first = False
-
-        nBoard[start[0]][start[1]].change_pos((end[0], end[1]))
-        nBoard[end[0]][end[1]] = nBoard[start[0]][start[1]]
-        nBoard[start[0]][start[1]] = 0
-        self.board = nBoard
-
-        if self.is_checked(color) or (checkedBefore and self.is_checked(color)):
-            changed = False
-            nBoard = self.board[:]
-            if nBoard[end[0]][end[1]].pawn:
-                nBoard[end[0]][end[1]].first = True
-
-            nBoard[end[0]][end[1]].change_pos((start[0], start[1]))
-            nBoard[start[0]][start[1]] = nBoard[end[0]][end[1]]
-            nBoard[end[0]][end[1]] = 0
-            self.board = nBoard
+        position = self.position
+        if COLORS[position.turn] != color:
+            return False
+
+        start_sq = square(start[0], start[1])
+        end_sq = square(end[0], end[1])
+        move = None
+        for m in self.legal_moves():
+            if move_from(m) == start_sq and move_to(m) == end_sq and move_promotion(m) in (0, QUEEN):
+                move = m
+                break
+
+        if move is None:
+            return False
+
+        self.clock.press()
+        self.apply_move(move)
+        if position.halfmove == 0:
+            self.repetitions.clear()
+        key = position.key()
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+
+        self.version += 1
+        self.prev_move_version = self.move_version
+        self.move_version = self.version
+
+        return True
+
+    def apply_move(self, move):
+        """
+        Plays an already validated move and updates the rendering view. Clients use this
+        to replay the moves the server sends them.
+
+        :param move: The packed move.
+        """
+        for sq in self.position.make_move(move):
+            self._refresh_square(sq)
+        self.reset_selected()
+        self.last = [divmod(move_from(move), self.cols), divmod(move_to(move), self.cols)]
+        self.last_move = move
+        self.turn = COLORS[self.position.turn]
+
+    def touch(self):
+        """
+        Marks the board as changed so clients holding an older version get an update.
+        Call after changing ready, winner or the player names from outside the board.
+        """
+        self.version += 1
+
+    def set_name(self, color, name):
+        """
+        Sets a player's display name.
+
+        :param color: The player's color ('w' or 'b').
+        :param name: The name to show.
+        """
+        if color == "w":
+            self.p1Name = name
         else:
-            self.reset_selected()
+            self.p2Name = name
+        self.touch()
+        self.names_version = self.version
 
-        self.update_moves()
-        if changed:
-            self.last = [start, end]
-            if self.turn == "w":
-                self.storedTime1 += (time.time() - self.startTime)
-            else:
-                self.storedTime2 += (time.time() - self.startTime)
-            self.startTime = time.time()
 
-        return changed
+class BoardPool:
+    def __init__(self, capacity=BOARD_POOL_CAPACITY, backend=DEFAULT_BACKEND):
+        """
+        Keeps the boards of finished games for reuse, so starting a game does not build
+        a new position, clock and tables. Boards are reset when they are given back, which
+        leaves handing one out as cheap as popping it from a list.
+
+        :param capacity: The most idle boards kept; any beyond that are left to the garbage collector.
+        :param backend: Name of the position implementation from BACKENDS.
+        """
 
+        self.capacity = capacity
+        self.backend = backend
+        self.free = []
+        self.created = 0
+        self.reused = 0
 
+    def fill(self, count=None):
+        """
+        Builds idle boards ahead of time, e.g. at startup so a burst of new games finds them ready.
 
+        :param count: How many idle boards to have, at most the capacity. Defaults to the capacity.
+        """
+        count = self.capacity if count is None else min(count, self.capacity)
+        while len(self.free) < count:
+            self.free.append(Board(BOARD_DIMENSION, BOARD_DIMENSION, self.backend))
+            self.created += 1
+
+    def acquire(self, time_control=MAX_TIME):
+        """
+        Hands out a board at the starting position.
+
+        :param time_control: Seconds on each player's clock.
+        :return: A reused board if one is idle, otherwise a new one.
+        """
+        if not self.free:
+            self.created += 1
+            return Board(BOARD_DIMENSION, BOARD_DIMENSION, self.backend, time_control)
+        board = self.free.pop()
+        board.clock.reset(time_control)
+        self.reused += 1
+        return board
+
+    def release(self, board):
+        """
+        Takes back the board of a finished game. Nothing may use the board afterwards.
+
+        :param board: A board handed out by acquire.
+        """
+        if len(self.free) < self.capacity:
+            board.reset()
+            self.free.append(board)
+
+    def stats(self):
+        """
+        Reports how many boards were built and how many game starts reused one.
+
+        :return: A dict with the idle, created and reused counts.
+        """
+        return {"idle": len(self.free), "created": self.created, "reused": self.reused}
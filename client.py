@@ -1,68 +1,189 @@
 import socket
-import pickle
+import select
 import time
+import pickle
+from collections import deque
+from protocol import decode_message
+from protocol import frame
+from protocol import FrameDecoder
+from protocol import decode_session
+from protocol import decode_ack
+from matchmaking import queue_request
+from matchmaking import DEFAULT_TIME_CONTROL
+from matchmaking import DEFAULT_RATING
+from sessions import resume_request
+from sessions import GRACE_SECONDS
 
 BUFFER_SIZE = 4096 * 8
 TIMEOUT_SECONDS = 5
+RECONNECT_DELAY_SECONDS = 1
 
 class Network:
-    def __init__(self):'
+    def __init__(self, time_control=DEFAULT_TIME_CONTROL, rating=DEFAULT_RATING):
         """
         Initializes the Network object, creates a socket connection to the server,
         and retrieves the initial game board state.
+
+        :param time_control: Seconds per side to queue for, one of matchmaking.TIME_CONTROLS.
+        :param rating: The player's rating, used to pair them with players of similar strength.
         """
 
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.client.settimeout(TIMEOUT_SECONDS)
         self.host = "localhost"
         self.port = 5555
         self.addr = (self.host, self.port)
-        self.board = self.connect()
-        self.board = pickle.loads(self.board)
+        self.time_control = time_control
+        self.rating = rating
+        self.decoder = FrameDecoder()
+        self.replies = deque()
+        # commands sent whose ack has not arrived yet
+        self.unanswered = 0
+        self.board = None
+        # issued by the server once seated, lets us take the seat back if the connection drops
+        self.token = None
+        self.board = decode_message(self.connect())
 
     def connect(self):
         """
-        Establishes a connection to the server and retrieves the initial game state.
-        
+        Establishes a connection to the server, joins the matchmaking queue and retrieves
+        the initial game state.
+
         :return: The response from the server containing the initial board state.
         """
-        
+
         self.client.connect(self.addr)
-        return self.client.recv(BUFFER_SIZE)
+        self.client.sendall(frame(queue_request(self.time_control, self.rating)))
+        return self.receive()
+
+    def resume(self):
+        """
+        Reconnects after the connection dropped and takes our seat back with the session
+        token. The server answers with only what changed since the board version we have.
+        Connecting is retried until the server's grace window would have run out.
+
+        :return: The board, caught up with the server.
+        """
+
+        if self.token is None:
+            raise ConnectionError("Connection lost and there is no session to resume")
+
+        deadline = time.monotonic() + GRACE_SECONDS
+        while True:
+            self.client.close()
+            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.client.settimeout(TIMEOUT_SECONDS)
+            try:
+                self.client.connect(self.addr)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(RECONNECT_DELAY_SECONDS)
+
+        self.decoder = FrameDecoder()
+        self.replies.clear()
+        # the server closes the connection if the seat is gone, receive raises in that case
+        self.client.sendall(frame(resume_request(self.token, self.board.version)))
+        # whatever was unanswered on the old connection is lost, the catch-up replaces it
+        self.unanswered = 1
+        self.settle()
+        return self.poll()
 
     def disconnect(self):
         """
         Closes the connection to the server.
         """
-        
+
         self.client.close()
 
+    def receive(self):
+        """
+        Reads from the socket until a whole message has arrived. Extra messages that
+        arrived in the same read are kept for the next call.
+
+        :return: The payload of the next message from the server.
+        """
+
+        while not self.replies:
+            chunk = self.client.recv(BUFFER_SIZE)
+            if not chunk:
+                raise ConnectionError("Server closed the connection")
+            self.replies.extend(self.decoder.feed(chunk))
+        return self.replies.popleft()
+
     def send(self, data, pick=False):
         """
-        Sends data to the server and waits for a response. The data can be pickled or plain string.
-        
+        Sends data to the server and waits for its answer. The data can be pickled or plain string.
+
         :param data: The data to send to the server, either as a string or an object to pickle.
         :param pick: A flag to indicate whether the data should be pickled before sending. Default is False.
-        :return: The response received from the server.
+        :return: The board, updated in place with the answer and everything pushed before it.
         """
-        
-        start_time = time.time()
-        while time.time() - start_time < TIMEOUT_SECONDS:
-            try:
-                if pick:
-                    self.client.send(pickle.dumps(data))
-                else:
-                    self.client.send(str.encode(data))
-                reply = self.client.recv(4096*8)
-                try:
-                    reply = pickle.loads(reply)
-                    break
-                except Exception as e:
-                    print(e)
 
-            except socket.error as e:
-                print(e)
+        try:
+            if pick:
+                self.client.sendall(frame(pickle.dumps(data)))
+            else:
+                self.client.sendall(frame(str.encode(data)))
+            self.unanswered += 1
+
+            # pushes for other changes may arrive first, the answer is over once its ack arrives
+            self.settle()
+        except OSError:
+            # the command may or may not have arrived, so it is not repeated
+            return self.resume()
+        return self.poll()
+
+    def settle(self):
+        """
+        Applies messages from the server until every command sent so far has been answered.
+        """
+
+        while self.unanswered:
+            self.apply(self.receive())
+
+    def poll(self):
+        """
+        Applies every message the server has pushed so far without waiting for more.
+        The server sends each change as it happens, so this replaces asking for the board.
+
+        :return: The board, updated in place.
+        """
+
+        try:
+            while select.select([self.client], [], [], 0)[0]:
+                chunk = self.client.recv(BUFFER_SIZE)
+                if not chunk:
+                    raise ConnectionError("Server closed the connection")
+                self.replies.extend(self.decoder.feed(chunk))
+            while self.replies:
+                self.apply(self.replies.popleft())
+            # only waits if one of the messages asked for a resync
+            self.settle()
+        except OSError:
+            return self.resume()
+        return self.board
 
+    def apply(self, data):
+        """
+        Decodes one message into the board, asking for a full snapshot if our copy is out of step.
 
-        return reply
+        :param data: The payload of a message from the server.
+        """
 
+        token = decode_session(data)
+        if token is not None:
+            self.token = token
+            return
+        if decode_ack(data):
+            self.unanswered = max(self.unanswered - 1, 0)
+            return
 
+        try:
+            decode_message(data, self.board)
+        except ValueError as e:
+            print(e)
+            # the snapshot comes back as the answer, whoever is waiting for answers applies it
+            self.client.sendall(frame(b"resync"))
+            self.unanswered += 1
@@ -0,0 +1,158 @@
+'''
+chess clocks on the monotonic clock
+GameClock keeps the two remaining times of one game and only does arithmetic when a
+clock is pressed; ClockEngine holds one flag-fall timer per game on the event loop's
+timer heap, so no game ever has to be polled to notice that time ran out
+'''
+
+import asyncio
+import time
+
+MAX_TIME = 900
+
+
+class GameClock:
+    def __init__(self, limit=MAX_TIME, now=time.monotonic):
+        """
+        Creates a stopped clock with the full time on both sides.
+
+        :param limit: The starting time of each side in seconds.
+        :param now: The time source, time.monotonic unless testing.
+        """
+
+        self.limit = limit
+        self.now = now
+        self.reset()
+
+    def reset(self, limit=None):
+        """
+        Stops the clock and gives both sides their full time again.
+
+        :param limit: A new starting time in seconds, or None to keep the current one.
+        """
+        if limit is not None:
+            self.limit = limit
+        # seconds left per color at the moment the running side's clock was started
+        self.remaining = [self.limit, self.limit]
+        self.running = None
+        self.started = 0.0
+
+    def start(self, color):
+        """
+        Starts counting down one side.
+
+        :param color: WHITE or BLACK.
+        """
+        self.running = color
+        self.started = self.now()
+
+    def press(self):
+        """
+        Stops the running side and starts the other one, as after a move.
+        """
+        if self.running is None:
+            return
+        now = self.now()
+        self.remaining[self.running] -= now - self.started
+        self.running ^= 1
+        self.started = now
+
+    def stop(self):
+        """
+        Stops the clock, keeping whatever time is left.
+        """
+        if self.running is None:
+            return
+        self.remaining[self.running] -= self.now() - self.started
+        self.running = None
+
+    def left(self, color):
+        """
+        Gives the time a side has left right now.
+
+        :param color: WHITE or BLACK.
+        :return: Seconds left, never below zero.
+        """
+        left = self.remaining[color]
+        if color == self.running:
+            left -= self.now() - self.started
+        return max(0.0, left)
+
+    def deadline(self):
+        """
+        Gives the moment the running side's flag falls.
+
+        :return: A time on the clock's time source, or None if the clock is stopped.
+        """
+        if self.running is None:
+            return None
+        return self.started + self.remaining[self.running]
+
+    def load(self, white_left, black_left, running):
+        """
+        Sets the clock from times received over the network and counts down locally from now.
+
+        :param white_left: Seconds white had left when the message was sent.
+        :param black_left: Seconds black had left when the message was sent.
+        :param running: The color whose clock is running, or None.
+        """
+        self.remaining = [white_left, black_left]
+        self.running = running
+        self.started = self.now()
+
+    def state(self):
+        """
+        Identifies the clock's state without reading the time, so it only changes when
+        the clock is started, pressed or stopped.
+
+        :return: A (white remaining, black remaining, running color) tuple.
+        """
+        return self.remaining[0], self.remaining[1], self.running
+
+
+class ClockEngine:
+    def __init__(self):
+        """
+        Keeps at most one pending flag-fall timer per game. Timers live on the running
+        asyncio loop, whose scheduler is a single heap shared by every game in the process.
+        """
+
+        # key -> (deadline, timer handle)
+        self.timers = {}
+
+    def schedule(self, key, deadline, callback):
+        """
+        Makes sure the game's only timer fires at the given deadline, replacing a timer
+        for an older deadline. Scheduling the same deadline again does nothing.
+
+        :param key: Identifies the game.
+        :param deadline: A time.monotonic() time, or None to just cancel.
+        :param callback: Called without arguments when the deadline passes.
+        """
+        current = self.timers.get(key)
+        if current is not None:
+            if current[0] == deadline:
+                return
+            current[1].cancel()
+            del self.timers[key]
+
+        if deadline is None:
+            return
+        delay = max(0.0, deadline - time.monotonic())
+        handle = asyncio.get_running_loop().call_later(delay, self._fire, key, callback)
+        self.timers[key] = (deadline, handle)
+
+    def cancel(self, key):
+        """
+        Drops the game's pending timer, if any.
+
+        :param key: Identifies the game.
+        """
+        self.schedule(key, None, None)
+
+    def _fire(self, key, callback):
+        del self.timers[key]
+        callback()
+
+    def __len__(self):
+        return len(self.timers)
@@ -229,25 +229,6 @@ def connect():
     n = Network()
     return n.board
 
-def send_winner(bo):
-    """
-    Sends winner to the board
-
-    :param bo: board object"
-    :return: updated board object
-    """
-    
-    if p1Time <= 0:
-        bo = n.send("winner b")
-    elif p2Time <= 0:
-        bo = n.send("winner w")
-
-    if bo.check_mate("b"):
-        bo = n.send("winner b")
-    elif bo.check_mate("w"):
-        bo = n.send("winner w")
-    return bo
-
 def main():
     """
     The main game loop that handles game state updates, user input, and rendering.
@@ -256,7 +237,6 @@ def main():
     global turn, bo, name
 
     color = bo.start_user
-    count = 0
 
     bo = n.send("update_moves")
     bo = n.send("name " + name)
@@ -264,15 +244,11 @@ def main():
     run = True
 
     while run:
-        if not color == "s":
-            p1Time = bo.time1
-            p2Time = bo.time2
-            if count == 60:
-                bo = n.send("get")
-                count = 0
-            else:
-                count += 1
-            clock.tick(30)
+        # the server pushes every change, so just apply whatever has arrived
+        bo = n.poll()
+        p1Time = bo.time1
+        p2Time = bo.time2
+        clock.tick(30)
 
         try:
             redraw_gameWindow(win, bo, p1Time, p2Time, color, bo.ready)
@@ -282,15 +258,16 @@ def main():
             run = False
             break
 
-        if not color == "s":
-            bo = send_winner(bo)
-        
+        # checkmate, draws and flag falls are decided by the server and published in bo.winner
         if bo.winner == "w":
             end_screen(win, "White is the Winner!")
             run = False
         elif bo.winner == "b":
             end_screen(win, "Black is the winner")
             run = False
+        elif bo.winner == "d":
+            end_screen(win, "Draw by " + bo.result)
+            run = False
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
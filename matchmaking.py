@@ -0,0 +1,162 @@
+'''
+matchmaking: games waiting for their second player, queued per bucket
+a bucket is a time control plus a rating band, so players are only paired with someone who
+asked for the same clock and is of similar strength; every operation is a dict or
+OrderedDict step, so the cost does not grow with the number of games or waiting players
+'''
+
+import time
+from collections import OrderedDict
+from clock import MAX_TIME
+
+# seconds per side players can ask for
+TIME_CONTROLS = (60, 180, 300, 600, MAX_TIME)
+DEFAULT_TIME_CONTROL = MAX_TIME
+DEFAULT_RATING = 1200
+RATING_BAND = 200
+MAX_RATING = 4000
+
+QUEUE_COMMAND = "queue"
+
+
+def queue_request(time_control=DEFAULT_TIME_CONTROL, rating=DEFAULT_RATING):
+    """
+    Builds the first message a player sends, asking to be seated.
+
+    :param time_control: Seconds per side, one of TIME_CONTROLS.
+    :param rating: The player's rating.
+    :return: The encoded request.
+    """
+    return (QUEUE_COMMAND + " " + str(time_control) + " " + str(rating)).encode("utf-8")
+
+
+def parse_queue_request(data):
+    """
+    Reads a player's seating request. Unknown time controls and out of range ratings
+    fall back to the defaults rather than refusing the player.
+
+    :param data: The payload of the player's first message.
+    :return: A (time control, rating) tuple, or None if the message is not a request.
+    """
+    parts = data.decode("utf-8", "ignore").split(" ")
+    if parts[0] != QUEUE_COMMAND:
+        return None
+    try:
+        time_control = int(parts[1])
+        rating = int(parts[2])
+    except (IndexError, ValueError):
+        return DEFAULT_TIME_CONTROL, DEFAULT_RATING
+    if time_control not in TIME_CONTROLS:
+        time_control = DEFAULT_TIME_CONTROL
+    if not 0 <= rating <= MAX_RATING:
+        rating = DEFAULT_RATING
+    return time_control, rating
+
+
+def bucket_of(time_control, rating):
+    """
+    Names the queue a request goes to.
+
+    :param time_control: Seconds per side.
+    :param rating: The player's rating.
+    :return: A (time control, rating band) tuple.
+    """
+    return time_control, rating // RATING_BAND
+
+
+class Matchmaker:
+    def __init__(self, now=time.monotonic):
+        """
+        Creates empty queues.
+
+        :param now: The time source used to measure how long players wait.
+        """
+
+        self.now = now
+        # bucket -> OrderedDict of game ID -> (game, time it started waiting), oldest first
+        self.queues = {}
+        self.bucket_by_game = {}
+        # bucket -> [pairings, total seconds waited, longest wait]
+        self.latency = {}
+
+    def wait(self, game, bucket):
+        """
+        Offers a game's free seat to the next player asking for the same bucket.
+
+        :param game: The game, with one player seated. Needs an id attribute.
+        :param bucket: The game's bucket.
+        """
+        self.queues.setdefault(bucket, OrderedDict())[game.id] = (game, self.now())
+        self.bucket_by_game[game.id] = bucket
+
+    def pair(self, bucket):
+        """
+        Takes the free seat that has waited longest in a bucket. The seat is gone once
+        this returns, so it can never be handed out twice.
+
+        :param bucket: The bucket asked for.
+        :return: The game, or None if nobody in the bucket is waiting.
+        """
+        queue = self.queues.get(bucket)
+        if not queue:
+            return None
+        game_id, (game, since) = queue.popitem(last=False)
+        if not queue:
+            del self.queues[bucket]
+        del self.bucket_by_game[game_id]
+
+        waited = self.now() - since
+        stats = self.latency.setdefault(bucket, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        return game
+
+    def cancel(self, game_id):
+        """
+        Withdraws a game's free seat, for when its first player leaves before being paired.
+
+        :param game_id: The ID of the game.
+        :return: True if the game was waiting.
+        """
+        bucket = self.bucket_by_game.pop(game_id, None)
+        if bucket is None:
+            return False
+        queue = self.queues[bucket]
+        del queue[game_id]
+        if not queue:
+            del self.queues[bucket]
+        return True
+
+    def __len__(self):
+        return len(self.bucket_by_game)
+
+    def stats(self):
+        """
+        Reports queue lengths and how long paired players waited.
+
+        :return: A dict with the number waiting, total pairings, mean and longest wait in
+                 seconds, and the same figures per bucket.
+        """
+        buckets = {}
+        pairings = 0
+        waited = 0.0
+        longest = 0.0
+        for bucket in set(self.queues) | set(self.latency):
+            count, total, worst = self.latency.get(bucket, (0, 0.0, 0.0))
+            buckets[bucket] = {
+                "waiting": len(self.queues.get(bucket, ())),
+                "pairings": count,
+                "mean_wait": total / count if count else 0.0,
+                "max_wait": worst,
+            }
+            pairings += count
+            waited += total
+            longest = max(longest, worst)
+        return {
+            "waiting": len(self),
+            "pairings": pairings,
+            "mean_wait": waited / pairings if pairings else 0.0,
+            "max_wait": longest,
+            "buckets": buckets,
+        }
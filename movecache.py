@@ -0,0 +1,106 @@
+'''
+bounded LRU cache of generated moves, keyed by the Zobrist key of a position
+the key covers placement, side to move, castling rights and a capturable en passant
+square, which is everything the legal moves and attack maps depend on, so one cache
+can be shared by every game in the process no matter which backend produced it
+'''
+
+from collections import OrderedDict
+from bitboard import WHITE
+from bitboard import BLACK
+
+DEFAULT_CAPACITY = 4096
+
+
+class MoveCache:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        Creates an empty cache.
+
+        :param capacity: The most positions kept before the least recently used is dropped.
+        """
+
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, position):
+        """
+        Finds a position's entry, making an empty one on a miss.
+
+        :param position: A bitboard or 0x88 position.
+        :return: A [moves, attacks] list, either of which may still be None.
+        """
+        key = position.key()
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+
+        entry = self.entries[key] = [None, None]
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def moves(self, position):
+        """
+        Returns the legal moves of a position, generating and storing them on a miss.
+
+        :param position: A bitboard or 0x88 position.
+        :return: A tuple of packed moves for the side to move.
+        """
+        entry = self._entry(position)
+        if entry[0] is None:
+            self.misses += 1
+            entry[0] = tuple(position.legal_moves())
+        else:
+            self.hits += 1
+        return entry[0]
+
+    def attacks(self, position):
+        """
+        Returns the attack maps of a position, computing and storing them on a miss.
+        They are kept apart from the moves so a lookup only pays for what it asks for.
+
+        :param position: A bitboard or 0x88 position.
+        :return: A tuple of the white and black attack bitboards.
+        """
+        entry = self._entry(position)
+        if entry[1] is None:
+            self.misses += 1
+            entry[1] = (position.attack_set(WHITE), position.attack_set(BLACK))
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def clear(self):
+        """
+        Drops every entry and resets the counters.
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Reports how well the cache is doing.
+
+        :return: A dict with the size, capacity, hits, misses, evictions and hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# shared by every board in the process
+move_cache = MoveCache()
@@ -0,0 +1,188 @@
+'''
+perft: counts the leaf nodes of the legal move tree to a fixed depth
+the counts for the positions below are well known, so any difference means the move
+generator is wrong, and the timing doubles as a benchmark of the move generator
+
+usage:
+    python perft.py                          run the whole suite against the expected counts
+    python perft.py --position kiwipete -d 3 count one position to depth 3
+    python perft.py --fen "<fen>" -d 2 --divide
+    python perft.py --backend mailbox
+'''
+
+import argparse
+import sys
+import time
+from board import Board
+from board import BACKENDS
+from board import DEFAULT_BACKEND
+from bitboard import START_FEN
+from bitboard import PIECE_LETTERS
+from bitboard import move_from
+from bitboard import move_to
+from bitboard import move_promotion
+
+# name: (fen, expected leaf counts for depth 1, 2, 3, ...)
+POSITIONS = {
+    "start": (START_FEN, (20, 400, 8902, 197281, 4865609)),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 (48, 2039, 97862, 4085603)),
+    "endgame": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                (14, 191, 2812, 43238, 674624)),
+    "promotions": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                   (6, 264, 9467, 422333)),
+    "discovered": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                   (44, 1486, 62379, 2103487)),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   (46, 2079, 89890, 3894594)),
+}
+
+# deepest depth of each position run by the default suite, picked to finish in seconds
+SUITE_DEPTHS = {
+    "start": 4,
+    "kiwipete": 3,
+    "endgame": 4,
+    "promotions": 3,
+    "discovered": 3,
+    "middlegame": 3,
+}
+
+
+def move_name(move):
+    """
+    Formats a packed move in coordinate notation, e.g. e2e4 or e7e8q.
+
+    :param move: The packed move.
+    :return: The move as a string.
+    """
+    start = move_from(move)
+    end = move_to(move)
+    name = "abcdefgh"[start % 8] + str(8 - start // 8) + "abcdefgh"[end % 8] + str(8 - end // 8)
+    promotion = move_promotion(move)
+    if promotion:
+        name += PIECE_LETTERS[promotion]
+    return name
+
+
+def perft(position, depth):
+    """
+    Counts the leaf nodes of the legal move tree below a position.
+
+    :param position: The position, left unchanged when the count returns.
+    :param depth: The number of plies to search.
+    :return: The number of leaf nodes.
+    """
+    if depth == 0:
+        return 1
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def divide(position, depth):
+    """
+    Counts the leaf nodes below each root move separately, which narrows a wrong
+    total down to the move whose subtree is wrong.
+
+    :param position: The position, left unchanged when the count returns.
+    :param depth: The number of plies to search, including the root move.
+    :return: A dict mapping move names to leaf counts.
+    """
+    counts = {}
+    for move in position.legal_moves():
+        position.make_move(move)
+        counts[move_name(move)] = perft(position, depth - 1)
+        position.unmake_move()
+    return counts
+
+
+def make_board(fen, backend):
+    """
+    Builds a board on the given backend and loads a position into it.
+
+    :param fen: The position in Forsyth-Edwards notation.
+    :param backend: Name of the position implementation from board.BACKENDS.
+    :return: The Board.
+    """
+    bo = Board(8, 8, backend)
+    bo.position.set_fen(fen)
+    return bo
+
+
+def run(fen, depth, backend, expected=()):
+    """
+    Counts every depth from 1 up to depth, printing the node count and speed of each.
+
+    :param fen: The position in Forsyth-Edwards notation.
+    :param depth: The deepest depth to count.
+    :param backend: Name of the position implementation from board.BACKENDS.
+    :param expected: Known counts per depth to check against.
+    :return: True if every count with a known value matched.
+    """
+    position = make_board(fen, backend).position
+    ok = True
+    for d in range(1, depth + 1):
+        start = time.perf_counter()
+        nodes = perft(position, d)
+        elapsed = time.perf_counter() - start
+        status = ""
+        if d <= len(expected):
+            if nodes == expected[d - 1]:
+                status = "ok"
+            else:
+                status = "FAIL expected " + str(expected[d - 1])
+                ok = False
+        nps = nodes / elapsed if elapsed > 0 else 0
+        print("[PERFT] depth", d, "nodes", nodes, "time %.3fs" % elapsed, "nps %d" % nps, status)
+    return ok
+
+
+def main(argv=None):
+    """
+    Parses the command line and runs perft.
+
+    :param argv: The arguments, defaults to sys.argv.
+    :return: The process exit code, 1 if any count was wrong.
+    """
+    parser = argparse.ArgumentParser(description="Count legal move tree leaves to check and time the move generator.")
+    parser.add_argument("-d", "--depth", type=int, help="depth to count to")
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="one of the built in positions")
+    parser.add_argument("--fen", help="any position in FEN")
+    parser.add_argument("--divide", action="store_true", help="print the count below every root move")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND)
+    args = parser.parse_args(argv)
+
+    if args.fen or args.position:
+        fen, expected = POSITIONS[args.position] if args.position else (args.fen, ())
+        depth = args.depth or 3
+        print("[PERFT]", fen, "on", args.backend)
+        if args.divide:
+            counts = divide(make_board(fen, args.backend).position, depth)
+            for name in sorted(counts):
+                print(name, counts[name])
+            print("[PERFT] moves", len(counts), "nodes", sum(counts.values()))
+            return 0 if depth > len(expected) or sum(counts.values()) == expected[depth - 1] else 1
+        return 0 if run(fen, depth, args.backend, expected) else 1
+
+    failed = []
+    total_start = time.perf_counter()
+    for name, (fen, expected) in POSITIONS.items():
+        print("[PERFT]", name, "on", args.backend)
+        if not run(fen, args.depth or SUITE_DEPTHS[name], args.backend, expected):
+            failed.append(name)
+    print("[PERFT] suite took %.2fs" % (time.perf_counter() - total_start))
+    if failed:
+        print("[ERROR] Wrong counts in", ", ".join(failed))
+        return 1
+    print("[PERFT] All counts match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
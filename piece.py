@@ -1,46 +1,10 @@
-import pygame
-import os
-
-PIECE_SIZE = (55, 55)
-BOARD_SIZE = 8
-BOARD_MAX_INDEX = BOARD_SIZE - 1
-X_COORDINATE = 113
-Y_COORDINATE = 113
-BOARD_WIDTH = 525
-BOARD_HEIGHT = 525
-
-b_bishop = pygame.image.load(os.path.join("img", "black_bishop.png"))
-b_king = pygame.image.load(os.path.join("img", "black_king.png"))
-b_knight = pygame.image.load(os.path.join("img", "black_knight.png"))
-b_pawn = pygame.image.load(os.path.join("img", "black_pawn.png"))
-b_queen = pygame.image.load(os.path.join("img", "black_queen.png"))
-b_rook = pygame.image.load(os.path.join("img", "black_rook.png"))
-
-w_bishop = pygame.image.load(os.path.join("img", "white_bishop.png"))
-w_king = pygame.image.load(os.path.join("img", "white_king.png"))
-w_knight = pygame.image.load(os.path.join("img", "white_knight.png"))
-w_pawn = pygame.image.load(os.path.join("img", "white_pawn.png"))
-w_queen = pygame.image.load(os.path.join("img", "white_queen.png"))
-w_rook = pygame.image.load(os.path.join("img", "white_rook.png"))
-
-b = [b_bishop, b_king, b_knight, b_pawn, b_queen, b_rook]
-w = [w_bishop, w_king, w_knight, w_pawn, w_queen, w_rook]
-
-B = []
-W = []
-
-for img in b:
-    B.append(pygame.transform.scale(img, PIECE_SIZE))
-
-for img in w:
-    W.append(pygame.transform.scale(img, PIECE_SIZE))
+# Piece objects are only a view of a position for rendering: the rules live in
+# bitboard.Position and x88.MailboxPosition, and board.Board fills in move_list
 
 
 class Piece:
     img = -1
-    (X_COORDINATE,Y_COORDINATE,BOARD_WIDTH,BOARD_HEIGHT)
-    startX = rect[0]
-    startY = rect[1]
+    __slots__ = ("row", "col", "color", "selected", "move_list", "king", "pawn")
 
     def __init__(self, row, col, color):
         """
@@ -67,15 +31,6 @@ class Piece:
         """
         return self.selected
 
-    def update_valid_moves(self, board):
-        """
-        Checks if the piece is selected.
-        
-        :return: True if the piece is selected, False otherwise.
-        """
-        
-        self.move_list = self.valid_moves(board)
-
     def draw(self, win, color):
         """
         Draws the piece on the board.
@@ -83,19 +38,9 @@ class Piece:
         :param win: The Pygame window object where the piece will be drawn.
         :param color: The color of the selected piece to highlight.
         """
-        
-        if self.color == "w":
-            drawThis = W[self.img]
-        else:
-            drawThis = B[self.img]
-
-        x = (4 - self.col) + round(self.startX + (self.col * self.rect[2] / BOARD_SIZE))
-        y = 3 + round(self.startY + (self.row * self.rect[3] / BOARD_SIZE))
-
-        if self.selected and self.color == color:
-            pygame.draw.rect(win, (255, 0, 0), (x, y, 62, 62), 4)
-
-        win.blit(drawThis, (x, y))
+        # imported here so boards can be built without pygame
+        from render import draw_piece
+        draw_piece(win, self, color)
 
     def change_pos(self, pos):
         """
@@ -118,89 +63,12 @@ class Piece:
 
 class Bishop(Piece):
     img = 0
-
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a bishop piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the bishop as tuples of (row, col).
-        """
-        
-        i = self.row
-        j = self.col
-
-        moves = []
-
-        # TOP RIGHT
-        djL = j + 1
-        djR = j - 1
-        for di in range(i - 1, -1, -1):
-            if djL < BOARD_SIZE:
-                p = board[di][djL]
-                if p == 0:
-                    moves.append((djL, di))
-                elif p.color != self.color:
-                    moves.append((djL, di))
-                    break
-                else:
-                    break
-            else:
-                break
-
-            djL += 1
-
-        for di in range(i - 1, -1, -1):
-            if djR > -1:
-                p = board[di][djR]
-                if p == 0:
-                    moves.append((djR, di))
-                elif p.color != self.color:
-                    moves.append((djR, di))
-                    break
-                else:
-                    break
-            else:
-                break
-
-            djR -= 1
-
-        # TOP LEFT
-        djL = j + 1
-        djR = j - 1
-        for di in range(i + 1, BOARD_SIZE):
-            if djL < BOARD_SIZE:
-                p = board[di][djL]
-                if p == 0:
-                    moves.append((djL, di))
-                elif p.color != self.color:
-                    moves.append((djL, di))
-                    break
-                else:
-                    break
-            else:
-                break
-            djL += 1
-        for di in range(i + 1, BOARD_SIZE):
-            if djR > -1:
-                p = board[di][djR]
-                if p == 0:
-                    moves.append((djR, di))
-                elif p.color != self.color:
-                    moves.append((djR, di))
-                    break
-                else:
-                    break
-            else:
-                break
-
-            djR -= 1
-
-        return moves
+    __slots__ = ()
 
 
 class King(Piece):
     img = 1
+    __slots__ = ()
 
     def __init__(self, row, col, color):
         """
@@ -214,166 +82,15 @@ class King(Piece):
         super().__init__(row, col, color)
         self.king = True
 
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a king piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the king as tuples of (row, col).
-        """
-        i = self.row
-        j = self.col
-
-        moves = []
-
-        if i > 0:
-            # TOP LEFT
-            if j > 0:
-                p = board[i - 1][j - 1]
-                if p == 0:
-                    moves.append((j - 1, i - 1,))
-                elif p.color != self.color:
-                    moves.append((j - 1, i - 1,))
-
-            # TOP MIDDLE
-            p = board[i - 1][j]
-            if p == 0:
-                moves.append((j, i - 1))
-            elif p.color != self.color:
-                moves.append((j, i - 1))
-
-            # TOP RIGHT
-            if j < BOARD_MAX_INDEX:
-                p = board[i - 1][j + 1]
-                if p == 0:
-                    moves.append((j + 1, i - 1,))
-                elif p.color != self.color:
-                    moves.append((j + 1, i - 1,))
-
-        if i < BOARD_MAX_INDEX:
-            # BOTTOM LEFT
-            if j > 0:
-                p = board[i + 1][j - 1]
-                if p == 0:
-                    moves.append((j - 1, i + 1,))
-                elif p.color != self.color:
-                    moves.append((j - 1, i + 1,))
-
-            # BOTTOM MIDDLE
-            p = board[i + 1][j]
-            if p == 0:
-                moves.append((j, i + 1))
-            elif p.color != self.color:
-                moves.append((j, i + 1))
-
-            # BOTTOM RIGHT
-            if j < BOARD_MAX_INDEX:
-                p = board[i + 1][j + 1]
-                if p == 0:
-                    moves.append((j + 1, i + 1))
-                elif p.color != self.color:
-                    moves.append((j + 1, i + 1))
-
-        # MIDDLE LEFT
-        if j > 0:
-            p = board[i][j - 1]
-            if p == 0:
-                moves.append((j - 1, i))
-            elif p.color != self.color:
-                moves.append((j - 1, i))
-
-        # MIDDLE RIGHT
-        if j < BOARD_MAX_INDEX:
-            p = board[i][j + 1]
-            if p == 0:
-                moves.append((j + 1, i))
-            elif p.color != self.color:
-                moves.append((j + 1, i))
-
-        return moves
-
 
 class Knight(Piece):
     img = 2
-
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a Knight piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the knight as tuples of (row, col).
-        """
-        
-        i = self.row
-        j = self.col
-
-        moves = []
-
-        # DOWN LEFT
-        if i < 6 and j > 0:
-            p = board[i + 2][j - 1]
-            if p == 0:
-                moves.append((j - 1, i + 2))
-            elif p.color != self.color:
-                moves.append((j - 1, i + 2))
-
-        # UP LEFT
-        if i > 1 and j > 0:
-            p = board[i - 2][j - 1]
-            if p == 0:
-                moves.append((j - 1, i - 2))
-            elif p.color != self.color:
-                moves.append((j - 1, i - 2))
-
-        # DOWN RIGHT
-        if i < 6 and j < BOARD_MAX_INDEX:
-            p = board[i + 2][j + 1]
-            if p == 0:
-                moves.append((j + 1, i + 2))
-            elif p.color != self.color:
-                moves.append((j + 1, i + 2))
-
-        # UP RIGHT
-        if i > 1 and j < BOARD_MAX_INDEX:
-            p = board[i - 2][j + 1]
-            if p == 0:
-                moves.append((j + 1, i - 2))
-            elif p.color != self.color:
-                moves.append((j + 1, i - 2))
-
-        if i > 0 and j > 1:
-            p = board[i - 1][j - 2]
-            if p == 0:
-                moves.append((j - 2, i - 1))
-            elif p.color != self.color:
-                moves.append((j - 2, i - 1))
-
-        if i > 0 and j < 6:
-            p = board[i - 1][j + 2]
-            if p == 0:
-                moves.append((j + 2, i - 1))
-            elif p.color != self.color:
-                moves.append((j + 2, i - 1))
-
-        if i < BOARD_MAX_INDEX and j > 1:
-            p = board[i + 1][j - 2]
-            if p == 0:
-                moves.append((j - 2, i + 1))
-            elif p.color != self.color:
-                moves.append((j - 2, i + 1))
-
-        if i < BOARD_MAX_INDEX and j < 6:
-            p = board[i + 1][j + 2]
-            if p == 0:
-                moves.append((j + 2, i + 1))
-            elif p.color != self.color:
-                moves.append((j + 2, i + 1))
-
-        return moves
+    __slots__ = ()
 
 
 class Pawn(Piece):
     img = 3
+    __slots__ = ("first", "queen")
 
     def __init__(self, row, col, color):
         """
@@ -388,258 +105,12 @@ class Pawn(Piece):
         self.queen = False
         self.pawn = True
 
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a pawn piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the pawn as tuples of (row, col).
-        """
-        
-        i = self.row
-        j = self.col
-
-        moves = []
-        try:
-            if self.color == "b":
-                if i < BOARD_MAX_INDEX:
-                    p = board[i + 1][j]
-                    if p == 0:
-                        moves.append((j, i + 1))
-
-                    # DIAGONAL
-                    if j < BOARD_MAX_INDEX:
-                        p = board[i + 1][j + 1]
-                        if p != 0:
-                            if p.color != self.color:
-                                moves.append((j + 1, i + 1))
-
-                    if j > 0:
-                        p = board[i + 1][j - 1]
-                        if p != 0:
-                            if p.color != self.color:
-                                moves.append((j - 1, i + 1))
-
-                if self.first:
-                    if i < 6:
-                        p = board[i + 2][j]
-                        if p == 0:
-                            if board[i + 1][j] == 0:
-                                moves.append((j, i + 2))
-                        elif p.color != self.color:
-                            moves.append((j, i + 2))
-            # WHITE
-            else:
-
-                if i > 0:
-                    p = board[i - 1][j]
-                    if p == 0:
-                        moves.append((j, i - 1))
-
-                if j < BOARD_MAX_INDEX:
-                    p = board[i - 1][j + 1]
-                    if p != 0:
-                        if p.color != self.color:
-                            moves.append((j + 1, i - 1))
-
-                if j > 0:
-                    p = board[i - 1][j - 1]
-                    if p != 0:
-                        if p.color != self.color:
-                            moves.append((j - 1, i - 1))
-
-                if self.first:
-                    if i > 1:
-                        p = board[i - 2][j]
-                        if p == 0:
-                            if board[i - 1][j] == 0:
-                                moves.append((j, i - 2))
-                        elif p.color != self.color:
-                            moves.append((j, i - 2))
-        except:
-            pass
-
-        return moves
-
 
 class Queen(Piece):
     img = 4
-
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a Queen piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the Queen as tuples of (row, col).
-        """
-        
-        i = self.row
-        j = self.col
-
-        moves = []
-
-        # TOP RIGHT
-        djL = j + 1
-        djR = j - 1
-        for di in range(i - 1, -1, -1):
-            if djL < BOARD_SIZE:
-                p = board[di][djL]
-                if p == 0:
-                    moves.append((djL, di))
-                elif p.color != self.color:
-                    moves.append((djL, di))
-                    break
-                else:
-                    djL = 9
-
-            djL += 1
-
-        for di in range(i - 1, -1, -1):
-            if djR > -1:
-                p = board[di][djR]
-                if p == 0:
-                    moves.append((djR, di))
-                elif p.color != self.color:
-                    moves.append((djR, di))
-                    break
-                else:
-                    djR = -1
-
-            djR -= 1
-
-        # TOP LEFT
-        djL = j + 1
-        djR = j - 1
-        for di in range(i + 1, BOARD_SIZE):
-            if djL < BOARD_SIZE:
-                p = board[di][djL]
-                if p == 0:
-                    moves.append((djL, di))
-                elif p.color != self.color:
-                    moves.append((djL, di))
-                    break
-                else:
-                    djL = 9
-            djL += 1
-        for di in range(i + 1, BOARD_SIZE):
-            if djR > -1:
-                p = board[di][djR]
-                if p == 0:
-                    moves.append((djR, di))
-                elif p.color != self.color:
-                    moves.append((djR, di))
-                    break
-                else:
-                    djR = -1
-
-            djR -= 1
-
-        # UP
-        for x in range(i - 1, -1, -1):
-            p = board[x][j]
-            if p == 0:
-                moves.append((j, x))
-            elif p.color != self.color:
-                moves.append((j, x))
-                break
-            else:
-                break
-
-        # DOWN
-        for x in range(i + 1, BOARD_SIZE, 1):
-            p = board[x][j]
-            if p == 0:
-                moves.append((j, x))
-            elif p.color != self.color:
-                moves.append((j, x))
-                break
-            else:
-                break
-
-        # LEFT
-        for x in range(j - 1, -1, -1):
-            p = board[i][x]
-            if p == 0:
-                moves.append((x, i))
-            elif p.color != self.color:
-                moves.append((x, i))
-                break
-            else:
-                break
-
-        # RIGHT
-        for x in range(j + 1, BOARD_SIZE, 1):
-            p = board[i][x]
-            if p == 0:
-                moves.append((x, i))
-            elif p.color != self.color:
-                moves.append((x, i))
-                break
-            else:
-                break
-
-        return moves
+    __slots__ = ()
 
 
 class Rook(Piece):
     img = 5
-
-    def valid_moves(self, board):
-        """
-        Calculates the valid moves for a Rook piece.
-        
-        :param board: The current state of the chess board.
-        :return: A list of valid moves for the rook as tuples of (row, col).
-        """
-        
-        i = self.row
-        j = self.col
-
-        moves = []
-
-        # UP
-        for x in range(i - 1, -1, -1):
-            p = board[x][j]
-            if p == 0:
-                moves.append((j, x))
-            elif p.color != self.color:
-                moves.append((j, x))
-                break
-            else:
-                break
-
-        # DOWN
-        for x in range(i + 1, BOARD_SIZE, 1):
-            p = board[x][j]
-            if p == 0:
-                moves.append((j, x))
-            elif p.color != self.color:
-                moves.append((j, x))
-                break
-            else:
-                break
-
-        # LEFT
-        for x in range(j - 1, -1, -1):
-            p = board[i][x]
-            if p == 0:
-                moves.append((x, i))
-            elif p.color != self.color:
-                moves.append((x, i))
-                break
-            else:
-                break
-
-        # RIGHT
-        for x in range(j + 1, BOARD_SIZE, 1):
-            p = board[i][x]
-            if p == 0:
-                moves.append((x, i))
-            elif p.color != self.color:
-                moves.append((x, i))
-                break
-            else:
-                break
-
-        return moves
-
+    __slots__ = ()
@@ -0,0 +1,311 @@
+'''
+compact binary encoding of the game state shared by server.py and client.py
+a snapshot is a fixed 52 byte header (board packed as 64 nibbles) followed by the two player names,
+and is only sent on join or resync; afterwards clients get small deltas against the board version
+every message in either direction travels in a frame: a 2 byte little endian length, then the payload
+each command a client sends is answered with whatever it changed followed by an ack, so a client
+can tell the answer apart from pushes about changes it did not cause
+'''
+
+import struct
+from board import Board
+
+PROTOCOL_VERSION = 3
+
+MSG_SNAPSHOT = 1
+MSG_NO_CHANGE = 2
+MSG_CLOCK = 3
+MSG_MOVE = 4
+MSG_SESSION = 5
+MSG_ACK = 6
+
+NO_SQUARE = 255
+MAX_NAME_BYTES = 16
+TIME_SCALE = 10
+MAX_TIME_UNITS = 0xFFFF
+
+FLAG_READY = 1
+FLAG_BLACK_TO_MOVE = 2
+USER_SHIFT = 2
+WINNER_SHIFT = 4
+
+USERS = ("w", "b", "s")
+WINNERS = (None, "w", "b", "d")
+# must list every value Board.result can take
+RESULTS = (None, "checkmate", "stalemate", "insufficient material", "threefold repetition", "fifty-move rule",
+           "timeout", "resignation")
+
+FRAME_HEADER = struct.Struct("<H")
+MAX_FRAME_SIZE = 0xFFFF
+
+# version, type, board version, flags, result, castling, ep, selected, last from, last to,
+# time1, time2 (tenths of a second left when sent), halfmove, fullmove, 32 bytes of nibbles
+# while the game is on the side to move's clock is running and receivers count it down themselves
+SNAPSHOT = struct.Struct("<BBIBBBbBBBHHBH32s")
+# version, type, board version
+NO_CHANGE = struct.Struct("<BBI")
+# version, type, board version, flags, result, selected, time1, time2
+CLOCK = struct.Struct("<BBIBBBHH")
+# the clock delta followed by the packed move
+MOVE = struct.Struct("<BBIBBBHHH")
+# version, type, then the session token as utf-8
+SESSION = struct.Struct("<BB")
+# version, type; marks the end of the answer to one command
+ACK = struct.Struct("<BB")
+
+
+def _pack_time(seconds):
+    return max(0, min(MAX_TIME_UNITS, int(seconds * TIME_SCALE)))
+
+
+def _pack_name(name):
+    data = name.encode("utf-8")[:MAX_NAME_BYTES]
+    return bytes((len(data),)) + data
+
+
+def _unpack_name(data, offset):
+    length = data[offset]
+    start = offset + 1
+    return data[start:start + length].decode("utf-8", "ignore"), start + length
+
+
+def frame(payload):
+    """
+    Prefixes a payload with its length so it can be pipelined on a stream.
+
+    :param payload: The message bytes.
+    :return: The framed message.
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError("frame too large: " + str(len(payload)) + " bytes")
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    def __init__(self):
+        """
+        Reassembles length-prefixed frames from stream reads of any size.
+        """
+
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received bytes and extracts every frame they complete. Partial frames stay buffered.
+
+        :param data: Bytes read from the socket.
+        :return: A list of complete payloads, possibly empty.
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        end = len(self.buffer)
+        while end - offset >= FRAME_HEADER.size:
+            length = FRAME_HEADER.unpack_from(self.buffer, offset)[0]
+            start = offset + FRAME_HEADER.size
+            if end - start < length:
+                break
+            frames.append(bytes(self.buffer[start:start + length]))
+            offset = start + length
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+
+def _flags(bo, start_user):
+    flags = (USERS.index(start_user) << USER_SHIFT) | (WINNERS.index(bo.winner) << WINNER_SHIFT)
+    if bo.ready:
+        flags |= FLAG_READY
+    if bo.position.turn:
+        flags |= FLAG_BLACK_TO_MOVE
+    return flags
+
+
+def encode_snapshot(bo, start_user):
+    """
+    Encodes the full game state of a board.
+
+    :param bo: The board to encode.
+    :param start_user: The role of the receiving client ('w', 'b' or 's').
+    :return: The encoded snapshot as bytes.
+    """
+
+    position = bo.position
+    codes = position.squares()
+    packed = bytes((codes[i] << 4) | codes[i + 1] for i in range(0, len(codes), 2))
+    flags = _flags(bo, start_user)
+
+    last_from = last_to = NO_SQUARE
+    if bo.last:
+        last_from = bo.last[0][0] * bo.cols + bo.last[0][1]
+        last_to = bo.last[1][0] * bo.cols + bo.last[1][1]
+
+    header = SNAPSHOT.pack(PROTOCOL_VERSION, MSG_SNAPSHOT, bo.version, flags, RESULTS.index(bo.result),
+                           position.castling, position.ep,
+                           NO_SQUARE if bo.selected is None else bo.selected,
+                           last_from, last_to, _pack_time(bo.time1), _pack_time(bo.time2),
+                           min(position.halfmove, 255), position.fullmove, packed)
+    return header + _pack_name(bo.p1Name) + _pack_name(bo.p2Name)
+
+
+def encode_update(bo, start_user, known_version, known_times=None):
+    """
+    Encodes the smallest message that brings a client from the version it already has to the current one.
+
+    :param bo: The board to encode.
+    :param start_user: The role of the receiving client ('w', 'b' or 's').
+    :param known_version: The board version last sent to this client, or None to force a snapshot.
+    :param known_times: The clock state last sent to this client, used to detect clock-only changes.
+    :return: The encoded message as bytes.
+    """
+
+    if known_version is None or bo.names_version > known_version or bo.prev_move_version > known_version:
+        return encode_snapshot(bo, start_user)
+
+    if known_version == bo.version and known_times == bo.clock.state():
+        return NO_CHANGE.pack(PROTOCOL_VERSION, MSG_NO_CHANGE, bo.version)
+
+    fields = (bo.version, _flags(bo, start_user), RESULTS.index(bo.result),
+              NO_SQUARE if bo.selected is None else bo.selected,
+              _pack_time(bo.time1), _pack_time(bo.time2))
+    if bo.move_version > known_version:
+        return MOVE.pack(PROTOCOL_VERSION, MSG_MOVE, *fields, bo.last_move)
+    return CLOCK.pack(PROTOCOL_VERSION, MSG_CLOCK, *fields)
+
+
+def sent_times(bo):
+    """
+    Gives the state of the clock that was sent, to pass back to encode_update as known_times.
+    A running clock needs no updates: clients count it down themselves.
+
+    :param bo: The board that was encoded.
+    :return: The clock state tuple.
+    """
+    return bo.clock.state()
+
+
+def encode_session(token):
+    """
+    Encodes the session token a player presents to take their seat back after a disconnect.
+
+    :param token: The token, see sessions.new_token.
+    :return: The encoded message as bytes.
+    """
+    return SESSION.pack(PROTOCOL_VERSION, MSG_SESSION) + token.encode("utf-8")
+
+
+def decode_session(data):
+    """
+    Reads a session message. It carries no game state, so it is checked for before decode_message.
+
+    :param data: A message from the server.
+    :return: The token, or None if the message is not a session message.
+    """
+    if data[0] != PROTOCOL_VERSION or data[1] != MSG_SESSION:
+        return None
+    return data[SESSION.size:].decode("utf-8")
+
+
+def encode_ack():
+    """
+    Encodes the message that follows the answer to a client's command.
+
+    :return: The encoded message as bytes.
+    """
+    return ACK.pack(PROTOCOL_VERSION, MSG_ACK)
+
+
+def decode_ack(data):
+    """
+    Reads an ack. It carries no game state, so it is checked for before decode_message.
+
+    :param data: A message from the server.
+    :return: True if the message is an ack.
+    """
+    return data[0] == PROTOCOL_VERSION and data[1] == MSG_ACK
+
+
+def _apply_state(bo, version, flags, result, selected, time1, time2):
+    bo.version = version
+    if bo.selected != (None if selected == NO_SQUARE else selected):
+        bo.reset_selected()
+        if selected != NO_SQUARE:
+            bo.selected = selected
+            bo.show_selected()
+
+    bo.turn = "b" if flags & FLAG_BLACK_TO_MOVE else "w"
+    bo.ready = bool(flags & FLAG_READY)
+    bo.start_user = USERS[(flags >> USER_SHIFT) & 3]
+    bo.winner = WINNERS[(flags >> WINNER_SHIFT) & 3]
+    bo.result = RESULTS[result]
+    running = None
+    if bo.ready and bo.winner is None:
+        running = 1 if flags & FLAG_BLACK_TO_MOVE else 0
+    # turn the times left into a deadline on our own monotonic clock
+    bo.clock.load(time1 / TIME_SCALE, time2 / TIME_SCALE, running)
+
+
+def decode_message(data, bo=None):
+    """
+    Decodes any server message, updating the board in place.
+
+    :param data: The bytes produced by encode_snapshot or encode_update.
+    :param bo: The board to update. Required for deltas; a new one is created for a snapshot if None.
+    :return: The updated board.
+    """
+
+    version, kind = data[0], data[1]
+    if version != PROTOCOL_VERSION:
+        raise ValueError("unsupported protocol version " + str(version))
+
+    if kind == MSG_SNAPSHOT:
+        return decode_snapshot(data, bo)
+    if kind == MSG_NO_CHANGE:
+        bo.version = NO_CHANGE.unpack_from(data)[2]
+    elif kind == MSG_CLOCK:
+        _apply_state(bo, *CLOCK.unpack_from(data)[2:])
+    elif kind == MSG_MOVE:
+        fields = MOVE.unpack_from(data)
+        if fields[2] <= bo.version:
+            raise ValueError("stale move delta for version " + str(fields[2]))
+        bo.apply_move(fields[-1])
+        _apply_state(bo, *fields[2:-1])
+    else:
+        raise ValueError("unknown message type " + str(kind))
+    return bo
+
+
+def decode_snapshot(data, bo=None):
+    """
+    Decodes a snapshot into a board, updating it in place.
+
+    :param data: The bytes produced by encode_snapshot.
+    :param bo: The board to update. A new one is created if None.
+    :return: The updated board.
+    """
+
+    (version, kind, board_version, flags, result, castling, ep, selected, last_from, last_to,
+     time1, time2, halfmove, fullmove, packed) = SNAPSHOT.unpack_from(data)
+    if version != PROTOCOL_VERSION or kind != MSG_SNAPSHOT:
+        raise ValueError("unsupported message version " + str(version) + " type " + str(kind))
+
+    if bo is None:
+        bo = Board(8, 8)
+
+    codes = bytearray(len(packed) * 2)
+    for i, byte in enumerate(packed):
+        codes[2 * i] = byte >> 4
+        codes[2 * i + 1] = byte & 15
+
+    bo.reset_selected()
+    bo.position.load_squares(codes, 1 if flags & FLAG_BLACK_TO_MOVE else 0, castling, ep, halfmove, fullmove)
+    bo.refresh_view()
+    _apply_state(bo, board_version, flags, result, selected, time1, time2)
+
+    bo.last = None
+    if last_from != NO_SQUARE:
+        bo.last = [divmod(last_from, bo.cols), divmod(last_to, bo.cols)]
+
+    bo.p1Name, offset = _unpack_name(data, SNAPSHOT.size)
+    bo.p2Name, offset = _unpack_name(data, offset)
+    return bo
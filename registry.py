@@ -0,0 +1,110 @@
+'''
+registry of the live games on a server
+games are kept in a doubly linked ring in creation order so spectators can step forward
+and back in constant time; games waiting for their second player are queued by matchmaking.py
+'''
+
+
+class GameRegistry:
+    def __init__(self, first_id=0):
+        """
+        Creates an empty registry.
+
+        :param first_id: The ID given to the first game. IDs only ever grow, so an ID is never reused.
+        """
+
+        self.games = {}
+        self.next_id = first_id
+        # neighbours of every live game in creation order, the ends wrap around
+        self.following = {}
+        self.preceding = {}
+        self.head = None
+
+    def new_id(self):
+        """
+        Reserves the next game ID.
+
+        :return: An ID no other game has had.
+        """
+        game_id = self.next_id
+        self.next_id += 1
+        return game_id
+
+    def add(self, game):
+        """
+        Registers a game at the end of the navigation order.
+
+        :param game: The game, whose id attribute must be unique.
+        """
+        game_id = game.id
+        self.games[game_id] = game
+        if self.head is None:
+            self.head = game_id
+            self.following[game_id] = self.preceding[game_id] = game_id
+        else:
+            tail = self.preceding[self.head]
+            self.following[tail] = game_id
+            self.preceding[game_id] = tail
+            self.following[game_id] = self.head
+            self.preceding[self.head] = game_id
+
+    def remove(self, game_id):
+        """
+        Forgets a game.
+
+        :param game_id: The ID of the game.
+        :return: The removed game, or None if it was not registered.
+        """
+        game = self.games.pop(game_id, None)
+        if game is None:
+            return None
+        before = self.preceding.pop(game_id)
+        after = self.following.pop(game_id)
+        if after == game_id:
+            self.head = None
+        else:
+            self.following[before] = after
+            self.preceding[after] = before
+            if self.head == game_id:
+                self.head = after
+        return game
+
+    def get(self, game_id):
+        """
+        Looks up a game.
+
+        :param game_id: The ID of the game.
+        :return: The game, or None if it has ended.
+        """
+        return self.games.get(game_id)
+
+    def first(self):
+        """
+        Gives the oldest live game.
+
+        :return: The game, or None if there are no games.
+        """
+        return None if self.head is None else self.games[self.head]
+
+    def step(self, game_id, forward=True):
+        """
+        Moves to the neighbouring game in creation order, wrapping around at the ends.
+        If the game has ended since, navigation restarts from the oldest game.
+
+        :param game_id: The ID of the game navigated from.
+        :param forward: True for the next game, False for the previous one.
+        :return: The neighbouring game, or None if there are no games.
+        """
+        if game_id not in self.games:
+            return self.first()
+        links = self.following if forward else self.preceding
+        return self.games[links[game_id]]
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def __iter__(self):
+        return iter(list(self.games.values()))
@@ -0,0 +1,83 @@
+'''
+client-only rendering layer: maps board pieces to sprites
+sprites are loaded and scaled the first time a piece of that kind is drawn, so nothing
+here runs on the server, which never imports this module
+'''
+
+import pygame
+import os
+
+PIECE_SIZE = (55, 55)
+BOARD_SIZE = 8
+X_COORDINATE = 113
+Y_COORDINATE = 113
+BOARD_WIDTH = 525
+BOARD_HEIGHT = 525
+
+rect = (X_COORDINATE,Y_COORDINATE,BOARD_WIDTH,BOARD_HEIGHT)
+startX = rect[0]
+startY = rect[1]
+
+# indexed by Piece.img
+IMAGE_NAMES = ("bishop", "king", "knight", "pawn", "queen", "rook")
+
+sprites = {}
+
+
+def get_sprite(color, img):
+    """
+    Returns the scaled sprite for a piece, loading it on first use.
+
+    :param color: The color of the piece ('w' or 'b').
+    :param img: The piece's image index (Piece.img).
+    :return: The pygame surface to blit.
+    """
+    key = (color, img)
+    if key not in sprites:
+        prefix = "white" if color == "w" else "black"
+        image = pygame.image.load(os.path.join("img", prefix + "_" + IMAGE_NAMES[img] + ".png"))
+        sprites[key] = pygame.transform.scale(image, PIECE_SIZE)
+    return sprites[key]
+
+
+def draw_piece(win, piece, color):
+    """
+    Draws a piece on the board.
+
+    :param win: The Pygame window object where the piece will be drawn.
+    :param piece: The Piece to draw.
+    :param color: The color of the player looking at the board, whose selection is highlighted.
+    """
+
+    x = (4 - piece.col) + round(startX + (piece.col * rect[2] / BOARD_SIZE))
+    y = 3 + round(startY + (piece.row * rect[3] / BOARD_SIZE))
+
+    if piece.selected and piece.color == color:
+        pygame.draw.rect(win, (255, 0, 0), (x, y, 62, 62), 4)
+
+    win.blit(get_sprite(piece.color, piece.img), (x, y))
+
+
+def draw_board(win, bo, color):
+    """
+    Draws the last move markers and every piece of a board.
+
+    :param win: The Pygame surface where the board is drawn.
+    :param bo: The Board to draw.
+    :param color: The current player's color ('w' or 'b').
+    """
+    if bo.last and color == bo.turn:
+        y, x = bo.last[0]
+        y1, x1 = bo.last[1]
+
+        xx = (4 - x) +round(startX + (x * rect[2] / BOARD_SIZE))
+        yy = 3 + round(startY + (y * rect[3] / BOARD_SIZE))
+        pygame.draw.circle(win, (0,0,255), (xx+32, yy+30), 34, 4)
+        xx1 = (4 - x) + round(startX + (x1 * rect[2] / BOARD_SIZE))
+        yy1 = 3+ round(startY + (y1 * rect[3] / BOARD_SIZE))
+        pygame.draw.circle(win, (0, 0, 255), (xx1 + 32, yy1 + 30), 34, 4)
+
+    for i in range(bo.rows):
+        for j in range(bo.cols):
+            if bo.board[i][j] != 0:
+                draw_piece(win, bo.board[i][j], color)
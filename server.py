@@ -1,206 +1,1068 @@
+import argparse
+import asyncio
+import os
 import socket
-from _thread import *
-from board import Board
-import pickle
+import multiprocessing
+import signal
+import sys
 import time
+import select
+from collections import deque
+from board import BoardPool
+from protocol import encode_update
+from protocol import sent_times
+from protocol import frame
+from protocol import FrameDecoder
+from protocol import FRAME_HEADER
+from protocol import encode_session
+from protocol import encode_ack
+from movecache import move_cache
+from clock import ClockEngine
+from registry import GameRegistry
+from matchmaking import Matchmaker
+from matchmaking import parse_queue_request
+from matchmaking import bucket_of
+from matchmaking import DEFAULT_TIME_CONTROL
+from matchmaking import DEFAULT_RATING
+from sessions import SessionTable
+from sessions import parse_resume_request
+from sessions import game_of_token
+from sessions import GRACE_SECONDS
 
-MAX_CONNECTIONS = 6
-GAME_TIME_LIMIT = 900
 BUFFER_SIZE = 8192 *3
-
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+SPECTATOR_BUFFER_SIZE = 128
 
 server = "localhost"
 port = 5555
 
-server_ip = socket.gethostbyname(server)
+connections = 0
 
-try:
-    s.bind((server, port))
+games = GameRegistry()
+# games waiting for their second player, per time control and rating band
+matchmaker = Matchmaker()
 
-except socket.error as e:
-    print(str(e))
+# in a sharded server, the worker's datagram socket back to the router process
+router_channel = None
+ROUTER_MESSAGE_SIZE = 4096
+# the most the router reads of a player's first message; queue and resume requests are far
+# smaller, and everything after the first frame stays in the socket for the worker to read
+MAX_ROUTED_FRAME = 1024
+# how long the router waits for that first frame before giving up on the connection
+ROUTE_TIMEOUT_SECONDS = 10
+# hand-overs the router queues per worker while that worker's channel is full
+MAX_HANDOVER_BACKLOG = 4096
+# how long a worker waits for room on its channel when the router falls behind
+ROUTER_SEND_SECONDS = 1
 
-s.listen()
-print("[START] Waiting for a connection")
+SPECS_FILE = "specs.txt"
+SPECS_RELOAD_SECONDS = 5
 
-connections = 0
+spectartor_ids = set()
+# (mtime, size) of specs.txt when it was last read
+specs_stamp = None
+specs = 0
 
-games = {0:Board(8, 8)}
+# flag-fall timers of every game
+clocks = ClockEngine()
+# boards of finished games, reset and waiting for the next game
+boards = BoardPool()
 
-spectartor_ids = [] 
-specs = 0
+# seats players can reconnect to, and the timers that give up on those who do not
+sessions = SessionTable()
+grace_timers = ClockEngine()
 
 def read_specs():
     """
-    Reads the spectator IDs from the specs.txt file and stores them in the global list `spectartor_ids`.
-    If the file does not exist, it creates a new one.
+    Reads the spectator IDs from the specs.txt file into the global set `spectartor_ids`,
+    unless the file is unchanged since the last read. If the file does not exist, it creates a new one.
+
+    :return: True if the set was reloaded.
     """
-    
-    global spectartor_ids
 
-    spectartor_ids = []
+    global spectartor_ids, specs_stamp
+
     try:
-        with open("specs.txt", "r") as f:
-            for line in f:
-                spectartor_ids.append(line.strip())
-    except:
+        stat = os.stat(SPECS_FILE)
+    except OSError:
         print("[ERROR] No specs.txt file found, creating one...")
-        open("specs.txt", "w")
+        open(SPECS_FILE, "w").close()
+        stat = os.stat(SPECS_FILE)
+
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if stamp == specs_stamp:
+        return False
+
+    with open(SPECS_FILE, "r") as f:
+        spectartor_ids = {line.strip() for line in f if line.strip()}
+    specs_stamp = stamp
+    print("[SPECS] Loaded", len(spectartor_ids), "spectator addresses")
+    return True
+
+
+async def watch_specs():
+    """
+    Keeps `spectartor_ids` in step with specs.txt by checking its modification time on a
+    timer, so accepting a connection never touches the disk. On Unix, SIGHUP reloads at once.
+    """
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, read_specs)
+    while True:
+        await asyncio.sleep(SPECS_RELOAD_SECONDS)
+        read_specs()
+
+
+class Game:
+    def __init__(self, game_id, time_control=DEFAULT_TIME_CONTROL):
+        """
+        Creates a game and starts the task that owns its board. Every read or write of the
+        board goes through that task, so commands from both players and any spectators are
+        applied one at a time without locks.
+
+        :param game_id: The ID of the game.
+        :param time_control: Seconds on each player's clock.
+        """
+
+        self.id = game_id
+        self.board = boards.acquire(time_control)
+        self.players = []
+        # spectators currently watching, they get every change pushed like the players
+        self.spectators = set()
+        self.commands = asyncio.Queue()
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        """
+        Executes queued commands against the board until the game is closed, pushing
+        whatever changed to everyone connected to the game after each one.
+        """
+        while True:
+            handler, args, future = await self.commands.get()
+            if handler is None:
+                break
+            try:
+                result = handler(self, *args)
+                if future is not None:
+                    future.set_result(result)
+            except Exception as e:
+                if future is None:
+                    print(e)
+                else:
+                    future.set_exception(e)
+            self.broadcast()
+
+        # commands queued behind the close are never run, but whoever waits on them is told
+        while not self.commands.empty():
+            handler, args, future = self.commands.get_nowait()
+            if future is not None:
+                future.set_exception(self.ended())
+        # nothing runs against the board after this, so the next game can have it
+        boards.release(self.board)
+
+    def ended(self):
+        """
+        Makes the error raised for commands sent to a closed game.
+
+        :return: A ConnectionError, so connection loops treat it like the socket closing.
+        """
+        return ConnectionError("Game " + str(self.id) + " has ended")
+
+    def broadcast(self):
+        """
+        Sends the current state to every player and spectator that has not seen it yet.
+        Clients that are already up to date, like the one whose command was just answered,
+        get nothing, so an idle game sends no traffic at all.
+        """
+        bo = self.board
+        for player in self.players:
+            if player.behind(bo) and not player.writer.is_closing():
+                player.push(bo)
+
+        # spectators that were sent the same state are missing the same bytes, so each
+        # distinct message is encoded and framed once and that buffer goes to all of them
+        frames = {}
+        for spectator in self.spectators:
+            if not spectator.behind(bo) or spectator.writer.is_closing():
+                continue
+            seen = (spectator.known_version, spectator.known_times)
+            data = frames.get(seen)
+            if data is None:
+                data = frames[seen] = frame(spectator.update(bo))
+            else:
+                spectator.sent(bo)
+            spectator.writer.write(data)
+
+    def post(self, handler, *args):
+        """
+        Queues a function to run on the game's task without waiting for it. Raises the
+        ConnectionError from ended() once the game is closed.
 
+        :param handler: A function taking the game followed by args.
+        """
+        if self.closed:
+            raise self.ended()
+        self.commands.put_nowait((handler, args, None))
 
-def threaded_client(conn, game, spec=False):
+    async def call(self, handler, *args):
+        """
+        Runs a function on the game's task and waits for its result. Raises the
+        ConnectionError from ended() if the game is closed before it runs.
+
+        :param handler: A function taking the game followed by args.
+        :return: Whatever the handler returns.
+        """
+        if self.closed:
+            raise self.ended()
+        future = asyncio.get_running_loop().create_future()
+        await self.commands.put((handler, args, future))
+        return await future
+
+    def close(self):
+        """
+        Stops the game's task and disconnects everyone still seated.
+        """
+        clocks.cancel(self.id)
+        self.closed = True
+        self.commands.put_nowait((None, (), None))
+        for player in self.players:
+            player.writer.close()
+
+
+class Client:
+    def __init__(self, writer, color):
+        """
+        Per-connection state of a player or spectator.
+
+        :param writer: The asyncio stream writer of the connection.
+        :param color: 'w', 'b' or 's' for spectators.
+        """
+
+        self.writer = writer
+        self.color = color
+        self.name = None
+        self.known_version = None
+        self.known_times = None
+        # players only: presented on reconnect to take the seat back
+        self.token = None
+
+    def update(self, bo):
+        """
+        Encodes what this client is missing from the board and remembers what was sent.
+
+        :param bo: The board to encode.
+        :return: The encoded message.
+        """
+        data = encode_update(bo, self.color, self.known_version, self.known_times)
+        self.sent(bo)
+        return data
+
+    def sent(self, bo):
+        """
+        Records that this client now has the board's current state.
+
+        :param bo: The board that was sent.
+        """
+        self.known_version = bo.version
+        self.known_times = sent_times(bo)
+
+    def behind(self, bo):
+        """
+        Checks whether the board changed since this client was last sent it.
+
+        :param bo: The board to compare with.
+        :return: True if an update is due.
+        """
+        return self.known_version != bo.version or self.known_times != sent_times(bo)
+
+    def push(self, bo):
+        """
+        Queues what this client is missing on its connection. Only called from the game's
+        task, so replies and pushes reach the client in version order.
+
+        :param bo: The board to send.
+        """
+        self.writer.write(frame(self.update(bo)))
+
+
+def join_game(game, player):
+    """
+    Seats a player in a game and sends their first snapshot and their session token.
+    Runs on the game's task.
+
+    :param game: The game being joined.
+    :param player: The joining Client.
+    """
+    bo = game.board
+    game.players.append(player)
+    player.token = sessions.open(game, player)
+    player.push(bo)
+    player.writer.write(frame(encode_session(player.token)))
+
+    if player.color == "b":
+        bo.ready = True
+        bo.clock.start(bo.position.turn)
+        bo.touch()
+        schedule_clock(game)
+
+
+def hold_seat(game, player, writer):
     """
-    Handles communication with a client (player or spectator) in a separate thread.
-    
-    :param conn: The connection object representing the client connection.
-    :param game: The game ID associated with the game the client is joining.
-    :param spec: A boolean flag indicating whether the client is a spectator (True) or a player (False).
+    Keeps a player's seat for GRACE_SECONDS after their connection dropped, if the game
+    is in progress. Runs on the game's task, so it is ordered with a resume that raced it.
+
+    :param game: The player's game.
+    :param player: The Client whose connection dropped.
+    :param writer: The connection that dropped.
+    :return: False if the game should end instead.
+    """
+    if player.writer is not writer:
+        # they already came back on another connection, which owns the seat now
+        return True
+    bo = game.board
+    if not bo.ready or bo.winner is not None:
+        return False
+    grace_timers.schedule(player.token, time.monotonic() + GRACE_SECONDS,
+                          lambda: expire_seat(game, player, writer))
+    print("[SESSION] Player", player.name, "dropped, holding their seat in game", game.id)
+    return True
+
+
+def resume_seat(game, player, writer, known_version):
     """
-    
-    global pos, games, currentId, connections, specs
+    Moves a player's seat onto their new connection and sends what they missed while
+    away: a delta from the version they still have, or a snapshot if that is too old.
+    Runs on the game's task.
+
+    :param game: The player's game.
+    :param player: The player's Client, kept from before the disconnect.
+    :param writer: The asyncio stream writer of the new connection.
+    :param known_version: The board version the player reported, or None.
+    """
+    bo = game.board
+    grace_timers.cancel(player.token)
+    old = player.writer
+    player.writer = writer
+    if not old.is_closing():
+        # the old connection has not noticed it is dead yet
+        old.close()
+
+    if known_version is not None and known_version > bo.version:
+        known_version = None
+    player.known_version = known_version
+    # the clock kept running while they were away, so always send its state
+    player.known_times = None
+    player.push(bo)
+    player.writer.write(frame(encode_ack()))
 
-    if not spec:
-        name = None
-        bo = games[game]
 
-        if connections % 2 == 0:
-            currentId = "w"
+def schedule_clock(game):
+    """
+    Points the game's flag-fall timer at the current deadline, or cancels it once the
+    clock has stopped. Runs on the game's task after anything that can touch the clock.
+
+    :param game: The game whose clock may have changed.
+    """
+    clocks.schedule(game.id, None if game.board.winner else game.board.clock.deadline(),
+                    lambda: game.post(flag_fall))
+
+
+def flag_fall(game):
+    """
+    Ends the game on time when its timer fires. Runs on the game's task, so a move that
+    arrived first has already pressed the clock and the timer is simply rescheduled.
+
+    :param game: The game whose deadline passed.
+    """
+    if game.board.flag_fall():
+        print("[GAME] Player", game.board.winner, "won on time in game", game.id)
+    schedule_clock(game)
+
+
+def player_command(game, player, data):
+    """
+    Applies one command from a player to the board and answers it. Runs on the game's task,
+    which then pushes the change to the opponent and the spectators.
+
+    :param game: The player's game.
+    :param player: The Client that sent the command.
+    :param data: The decoded command string.
+    """
+    bo = game.board
+    words = data.split(" ")
+    command = words[0]
+
+    if command == "select":
+        # select <col> <row> <color>, only ever for the player's own pieces
+        try:
+            col = int(words[1])
+            row = int(words[2])
+            color = words[3]
+        except (IndexError, ValueError):
+            color = None
+        if color == player.color:
+            bo.select(col, row, color)
         else:
-            currentId = "b"
+            print("[ERROR] Bad command from player", player.name, "in game", game.id, "-", repr(data))
 
-        bo.start_user = currentId
+    # a player can only give the game to their opponent, and only while it is undecided
+    opponent = "b" if player.color == "w" else "w"
+    if command == "winner" and words[1:] == [opponent] and bo.winner is None:
+        bo.winner = opponent
+        bo.result = "resignation"
+        bo.clock.stop()
+        bo.touch()
+        print("[GAME] Player", player.color, "resigned in game", game.id)
 
-        # Pickle the object and send it to the server
-        data_string = pickle.dumps(bo)
+    if data == "resync":
+        player.known_version = None
 
-        if currentId == "b":
-            bo.ready = True
-            bo.startTime = time.time()
+    if data == "update moves":
+        bo.update_moves()
 
-        conn.send(data_string)
-        connections += 1
+    if command == "name" and len(words) > 1:
+        player.name = words[1]
+        bo.set_name(player.color, player.name)
 
-        while True:
-            if game not in games:
-                break
+    # every command is answered, even one that changed nothing, and the ack marks the end of
+    # the answer so the client can tell it apart from pushes that were already on the way
+    schedule_clock(game)
+    player.push(bo)
+    player.writer.write(frame(encode_ack()))
+
+
+def watch(game, spectator):
+    """
+    Subscribes a spectator to a game and answers with what they are missing. Runs on the game's task.
+
+    :param game: The game being watched.
+    :param spectator: The spectating Client.
+    """
+    game.spectators.add(spectator)
+    spectator.push(game.board)
+
+
+def report(event, game_id, *details):
+    """
+    Tells the router process about a change to one of this worker's games. Does nothing
+    when the server runs as a single process.
+
+    :param event: "ended" when the game is gone, "open" when it is waiting for a player.
+    :param game_id: The ID of the game.
+    :param details: For "open", the time control and rating the game waits with.
+    """
+    if router_channel is not None:
+        message = " ".join(str(part) for part in (event, game_id) + details)
+        if not send_to_router(message.encode("utf-8")):
+            print("[ERROR] Router is not reading, lost report:", message)
+
+
+def send_to_router(message, fds=()):
+    """
+    Sends a datagram to the router of a sharded server. If the router has fallen behind
+    and the channel is full, waits up to ROUTER_SEND_SECONDS for room.
+
+    :param message: The datagram.
+    :param fds: File descriptors to pass along with it.
+    :return: True if it was sent.
+    """
+    deadline = time.monotonic() + ROUTER_SEND_SECONDS
+    while True:
+        try:
+            socket.send_fds(router_channel, [message], list(fds))
+            return True
+        except BlockingIOError:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            select.select([], [router_channel], [], left)
+
+
+def claim_seat(game_id, color, time_control, rating):
+    """
+    Takes the seat the router picked for a player in a sharded server.
+
+    :param game_id: The ID of the game the router assigned.
+    :param color: The seat the router assigned, 'w' or 'b'.
+    :param time_control: The time control the player queued for.
+    :param rating: The player's rating.
+    :return: A (Game, color) tuple.
+    """
+    game = games.get(game_id)
+    if game is None:
+        # the game ended before its second player got here, so they start it instead
+        game = Game(game_id, time_control)
+        games.add(game)
+        if color == "b":
+            color = "w"
+            report("open", game_id, time_control, rating)
+    return game, color
+
+
+def find_game(time_control, rating):
+    """
+    Finds a seat for a new player: black in the game that has waited longest with the
+    same time control and rating band, or white in a new game if nobody there is waiting.
+    The seat is taken right away, so two players connecting at once can never be given
+    the same one.
+
+    :param time_control: The time control the player queued for.
+    :param rating: The player's rating.
+    :return: A (Game, color) tuple.
+    """
+    bucket = bucket_of(time_control, rating)
+    game = matchmaker.pair(bucket)
+    if game is not None:
+        print("[MATCH] Paired game", game.id, "in bucket", bucket)
+        return game, "b"
+
+    game = Game(games.new_id(), time_control)
+    games.add(game)
+    matchmaker.wait(game, bucket)
+    return game, "w"
+
+
+def end_game(game):
+    """
+    Removes a game from the server and disconnects whoever is still in it.
+
+    :param game: The game to end.
+    """
+    if games.remove(game.id) is None:
+        return
+    matchmaker.cancel(game.id)
+    for player in game.players:
+        sessions.close(player.token)
+        grace_timers.cancel(player.token)
+    game.close()
+    print("[GAME] Game", game.id, "ended")
+    print("[CACHE] Move cache", move_cache.stats())
+    print("[POOL] Boards", boards.stats())
+    if router_channel is None:
+        print("[MATCH] Matchmaking", matchmaker.stats())
+    report("ended", game.id)
+
+
+def expire_seat(game, player, writer):
+    """
+    Ends a game whose player did not come back within the grace window.
+
+    :param game: The player's game.
+    :param player: The player's Client.
+    :param writer: The connection that dropped. If the player has a newer one, they resumed in time.
+    """
+    if player.writer is writer:
+        print("[SESSION] Player", player.name, "did not return to game", game.id)
+        end_game(game)
+
+
+async def player_client(reader, writer, seat=None, pending=b""):
+    """
+    Handles communication with a player until they disconnect. A player's first message
+    says which queue to join, see matchmaking.queue_request; older clients that skip it
+    are queued with the defaults. A player coming back after a dropped connection sends
+    a resume request instead, see sessions.resume_request.
 
+    :param reader: The asyncio stream reader of the connection.
+    :param writer: The asyncio stream writer of the connection.
+    :param seat: The (game ID, color, time control, rating) chosen by the router in a sharded
+                 server, None to matchmake here.
+    :param pending: Bytes the router already read from the connection.
+    """
+
+    global connections
+
+    decoder = FrameDecoder()
+    commands = decoder.feed(pending)
+    resume = None
+    if seat is None:
+        try:
+            while not commands:
+                d = await reader.read(BUFFER_SIZE)
+                if not d:
+                    writer.close()
+                    return
+                commands = decoder.feed(d)
+        except OSError as e:
+            print(e)
+            writer.close()
+            return
+        resume = parse_resume_request(commands[0])
+        request = parse_queue_request(commands[0])
+        if resume is not None or request is not None:
+            commands.pop(0)
+
+    if resume is not None:
+        token, known_version = resume
+        session = sessions.get(token)
+        if session is None:
+            print("[SESSION] Unknown or expired session, closing")
+            writer.close()
+            return
+        game, player = session
+    else:
+        if seat is None:
+            game, color = find_game(*(request or (DEFAULT_TIME_CONTROL, DEFAULT_RATING)))
+        else:
+            game, color = claim_seat(*seat)
+        player = Client(writer, color)
+
+    # from here on the seat is taken, so however the connection ends it is given up below
+    connections += 1
+    try:
+        if resume is not None:
+            await game.call(resume_seat, player, writer, known_version)
+            print("[SESSION] Player", player.name, "resumed game", game.id)
+        else:
+            await game.call(join_game, player)
+        print("[DATA] Number of Connections:", connections)
+        print("[DATA] Number of Games:", len(games))
+        await writer.drain()
+
+        while game.id in games:
             try:
-                d = conn.recv(BUFFER_SIZE)
-                data = d.decode("utf-8")
+                for command in commands:
+                    await game.call(player_command, player, command.decode("utf-8", "replace"))
+                await writer.drain()
+                d = await reader.read(BUFFER_SIZE)
                 if not d:
                     break
-                else:
-                    if data.count("select") > 0:
-                        all = data.split(" ")
-                        col = int(all[1])
-                        row = int(all[2])
-                        color = all[3]
-                        bo.select(col, row, color)
-
-                    if data == "winner b":
-                        bo.winner = "b"
-                        print("[GAME] Player b won in game", game)
-                    if data == "winner w":
-                        bo.winner = "w"
-                        print("[GAME] Player w won in game", game)
-
-                    if data == "update moves":
-                        bo.update_moves()
-
-                    if data.count("name") == 1:
-                        name = data.split(" ")[1]
-                        if currentId == "b":
-                            bo.p2Name = name
-                        elif currentId == "w":
-                            bo.p1Name = name
-
-                    if bo.ready:
-                        if bo.turn == "w":
-                            bo.time1 = GAME_TIME_LIMIT - (time.time() - bo.startTime) - bo.storedTime1
-                        else:
-                            bo.time2 = GAME_TIME_LIMIT - (time.time() - bo.startTime) - bo.storedTime2
-
-                    sendData = pickle.dumps(bo)
-
-                conn.sendall(sendData)
+                commands = decoder.feed(d)
 
+            except OSError:
+                raise
             except Exception as e:
+                # a bug in one command should not cost the player their connection
                 print(e)
-        
+                commands = []
+
+    except OSError as e:
+        print(e)
+
+    finally:
         connections -= 1
+        writer.close()
+        held = game.id in games and await game.call(hold_seat, player, writer)
+        if not held:
+            end_game(game)
+            print("[DISCONNECT] Player", player.name, "left game", game.id)
+
+
+def return_spectator(writer, direction, game_id, pending):
+    """
+    Hands a spectator's connection back to the router of a sharded server, which sends
+    it on to the worker hosting the game they navigate to.
+
+    :param writer: The asyncio stream writer of the connection.
+    :param direction: "forward", "back", or "current" for any live game, preferring game_id.
+    :param game_id: The game navigated from, -1 if none.
+    :param pending: Frames the spectator sent after the navigation command.
+    :return: True if the router has the connection, False if it could not take it.
+    """
+    sock = writer.get_extra_info("socket")
+    message = " ".join(("spectate", direction, str(game_id))).encode("utf-8") + b"\n" + pending
+    return send_to_router(message, (sock.fileno(),))
+
+
+def spectator_commands(frames):
+    """
+    Decodes the frames a spectator sent into commands.
+
+    :param frames: The frame payloads.
+    :return: The command strings, with None for a queue request: clients open with one and
+             it is answered by the greeting, so unlike a command it gets no ack.
+    """
+    return [None if parse_queue_request(data) is not None else data.decode("utf-8", "replace")
+            for data in frames]
+
+
+async def spectator_client(reader, writer, game_id=-1, pending=b""):
+    """
+    Handles communication with a spectator, who can move forward and back through the live games.
+    In a sharded server the router keeps the order of every worker's games, so moving to
+    another game, or finding one when this worker has none, goes back through the router.
+
+    :param reader: The asyncio stream reader of the connection.
+    :param writer: The asyncio stream writer of the connection.
+    :param game_id: The game to start with, -1 for the oldest.
+    :param pending: Frames the spectator sent before reaching this worker.
+    """
+
+    global specs
+
+    specs += 1
+    spectator = Client(writer, "s")
+    watching = None
+    decoder = FrameDecoder()
+    # None just sends the current game, which is how a spectator is greeted; an empty command
+    # does the same but is acked, it stands for a command answered after a hand-back
+    commands = [None] + spectator_commands(decoder.feed(pending))
+    handed_back = False
+
+    while not handed_back:
         try:
-            del games[game]
-            print("[GAME] Game", game, "ended")
-        except:
-            pass
-        print("[DISCONNECT] Player", name, "left game", game)
-        conn.close()
+            for i, data in enumerate(commands):
+                direction = "current"
+                if watching is None:
+                    game = games.get(game_id) or games.first()
+                elif data == "forward" or data == "back":
+                    print("[SPECTATOR] Moved Games", data)
+                    direction = data
+                    game = games.step(watching.id, forward=data == "forward")
+                else:
+                    game = games.get(watching.id) or games.first()
+                if data == "resync":
+                    spectator.known_version = None
 
+                if router_channel is not None and (direction != "current" or game is None):
+                    # the game to watch may live on another worker, so the router picks it
+                    rest = b"".join(frame(command.encode("utf-8")) for command in commands[i + 1:]
+                                    if command is not None)
+                    if data is not None:
+                        rest = frame(b"") + rest
+                    if return_spectator(writer, direction, game_id if watching is None else watching.id,
+                                        rest + bytes(decoder.buffer)):
+                        handed_back = True
+                        break
+                    # the router is stuck, so stay on this worker's games for now
+
+                if game is None:
+                    raise ConnectionError("No games to spectate")
+                if game is not watching:
+                    if watching is not None:
+                        watching.spectators.discard(spectator)
+                    spectator.known_version = None
+                    watching = game
+                await game.call(watch, spectator)
+                if data is not None:
+                    writer.write(frame(encode_ack()))
+            if handed_back:
+                break
+            await writer.drain()
+
+            d = await reader.read(SPECTATOR_BUFFER_SIZE)
+            if not d:
+                break
+            commands = spectator_commands(decoder.feed(d))
+
+        except OSError as e:
+            print(e)
+            break
+        except Exception as e:
+            print(e)
+            commands = []
+
+    if watching is not None:
+        watching.spectators.discard(spectator)
+    if handed_back:
+        print("[SPECTATOR] Handed back to the router")
     else:
-        available_games = list(games.keys())
-        game_ind = 0
-        bo = games[available_games[game_ind]]
-        bo.start_user = "s"
-        data_string = pickle.dumps(bo)
-        conn.send(data_string)
+        print("[DISCONNECT] Spectator left")
+    specs -= 1
+    writer.close()
 
-        while True:
-            available_games = list(games.keys())
-            bo = games[available_games[game_ind]]
-            try:
-                d = conn.recv(128)
-                data = d.decode("utf-8")
-                if not d:
-                    break
-                else:
-                    try:
-                        if data == "forward":
-                            print("[SPECTATOR] Moved Games forward")
-                            game_ind += 1
-                            if game_ind >= len(available_games):
-                                game_ind = 0
-                        elif data == "back":
-                            print("[SPECTATOR] Moved Games back")
-                            game_ind -= 1
-                            if game_ind < 0:
-                                game_ind = len(available_games) -1
-
-                        bo = games[available_games[game_ind]]
-                    except:
-                        print("[ERROR] Invalid Game Recieved from Spectator")
-
-                    sendData = pickle.dumps(bo)
-                    conn.sendall(sendData)
 
-            except Exception as e:
-                print(e)
+async def handle_connection(reader, writer):
+    """
+    Entry point for every new socket: spectators are recognised by IP from specs.txt,
+    everyone else is matched into a game as a player.
+
+    :param reader: The asyncio stream reader of the connection.
+    :param writer: The asyncio stream writer of the connection.
+    """
+    addr = writer.get_extra_info("peername")
+    print("[CONNECT] New connection")
+
+    if addr and addr[0] in spectartor_ids:
+        await spectator_client(reader, writer)
+    else:
+        await player_client(reader, writer)
+
+
+async def adopt_connection(message, fd):
+    """
+    Serves a connection the router accepted and handed to this worker.
 
-        print("[DISCONNECT] Spectator left game", game)
-        specs -= 1
+    :param message: The router's routing decision, "player <game id> <color> <time control> <rating>",
+                    "resume" or "spectator <game id>", then a newline and any frames the router or
+                    another worker already read from the socket.
+    :param fd: The file descriptor of the client's socket.
+    """
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(False)
+    reader, writer = await asyncio.open_connection(sock=sock)
+    header, _, pending = message.partition(b"\n")
+    route = header.decode("utf-8").split(" ")
+    if route[0] == "player":
+        seat = (int(route[1]), route[2], int(route[3]), int(route[4]))
+        await player_client(reader, writer, seat, pending)
+    elif route[0] == "resume":
+        # the request is still in pending, player_client checks the token itself
+        await player_client(reader, writer, None, pending)
+    else:
+        await spectator_client(reader, writer, int(route[1]), pending)
+
+
+async def serve_worker(channel):
+    """
+    Runs a worker of a sharded server: games live here, connections arrive from the router.
+
+    :param channel: The worker's end of the datagram socket pair shared with the router.
+    """
+    global router_channel
+
+    router_channel = channel
+    loop = asyncio.get_running_loop()
+    boards.fill()
+
+    def on_message():
+        try:
+            message, fds, flags, _ = socket.recv_fds(channel, ROUTER_MESSAGE_SIZE, 1)
+        except BlockingIOError:
+            return
+        if flags & socket.MSG_TRUNC:
+            # never serve a connection with part of what the router read missing
+            print("[ERROR] Truncated routing message, dropping the connection")
+            for fd in fds:
+                os.close(fd)
+            return
+        for fd in fds:
+            loop.create_task(adopt_connection(message, fd))
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), on_message)
+    # serve until the router stops the process
+    await loop.create_future()
+
+
+def worker_process(channel):
+    """
+    Process entry point of a worker.
+
+    :param channel: The worker's end of the datagram socket pair shared with the router.
+    """
+    asyncio.run(serve_worker(channel))
+
+
+class RemoteGame:
+    def __init__(self, game_id, worker):
+        """
+        A game as the router sees it: only where it lives.
+
+        :param game_id: The ID of the game.
+        :param worker: The index of the worker process hosting it.
+        """
+
+        self.id = game_id
+        self.worker = worker
+
+
+async def route_connections(listener, channels):
+    """
+    Accepts every connection and hands its socket to a worker. The router does the
+    matchmaking, so players are paired across all workers; each game lives on worker
+    game ID modulo the worker count and both its players are sent there. Spectators are
+    sent to the worker hosting the game they watch, and workers hand them back here to
+    move to a game elsewhere.
+
+    :param listener: The listening socket.
+    :param channels: The router's ends of the datagram socket pairs, one per worker.
+    """
+    loop = asyncio.get_running_loop()
+    remote_games = GameRegistry()
+
+    def on_report(channel):
+        try:
+            message, fds, flags, _ = socket.recv_fds(channel, ROUTER_MESSAGE_SIZE, 1)
+        except BlockingIOError:
+            return
+        if flags & socket.MSG_TRUNC:
+            print("[ERROR] Truncated message from a worker")
+            for fd in fds:
+                os.close(fd)
+            return
+        header, _, pending = message.partition(b"\n")
+        report = header.decode("utf-8").split(" ")
+        if fds:
+            # "spectate <direction> <game id>": a spectator moving to a game on any worker
+            route_spectator(socket.socket(fileno=fds[0]), report[1], int(report[2]), pending)
+            return
+        event, game_id = report[0], int(report[1])
+        if event == "ended":
+            remote_games.remove(game_id)
+            matchmaker.cancel(game_id)
+            print("[MATCH] Matchmaking", matchmaker.stats())
+        elif event == "open" and game_id not in remote_games:
+            game = RemoteGame(game_id, game_id % len(channels))
+            remote_games.add(game)
+            matchmaker.wait(game, bucket_of(int(report[2]), int(report[3])))
+
+    # hand-overs waiting for room on each worker's channel, oldest first
+    backlog = [deque() for channel in channels]
+
+    async def receive_exactly(conn, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = await loop.sock_recv(conn, size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    async def receive_first_frame(conn):
+        header = await receive_exactly(conn, FRAME_HEADER.size)
+        if header is None or FRAME_HEADER.unpack(header)[0] > MAX_ROUTED_FRAME:
+            return None
+        return await receive_exactly(conn, FRAME_HEADER.unpack(header)[0])
+
+    async def route_player(conn):
+        # only the first frame is read, it says which queue to join; whatever the client
+        # pipelined after it stays in the socket, so it reaches the worker however long it is
+        try:
+            first = await asyncio.wait_for(receive_first_frame(conn), ROUTE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, OSError):
+            first = None
+        if first is None:
+            conn.close()
+            return
+
+        resume = parse_resume_request(first)
+        if resume is not None:
+            # a reconnect goes to the worker hosting its game, which checks the token
+            game_id = game_of_token(resume[0])
+            if game_id is None:
+                conn.close()
+                return
+            hand_over(game_id % len(channels), b"resume\n" + frame(first), conn)
+            return
+
+        request = parse_queue_request(first)
+        # an older client's first message is already a command, the worker runs it
+        pending = b"" if request is not None else frame(first)
+        time_control, rating = request or (DEFAULT_TIME_CONTROL, DEFAULT_RATING)
+
+        bucket = bucket_of(time_control, rating)
+        game = matchmaker.pair(bucket)
+        if game is None:
+            game_id = remote_games.new_id()
+            game = RemoteGame(game_id, game_id % len(channels))
+            remote_games.add(game)
+            matchmaker.wait(game, bucket)
+            color = "w"
+            # if the worker never gets the player, the game never existed
+            undo = lambda: (remote_games.remove(game.id), matchmaker.cancel(game.id))
+        else:
+            print("[MATCH] Paired game", game.id, "in bucket", bucket)
+            color = "b"
+            # if the worker never gets the player, the seat is free again
+            undo = lambda: game.id in remote_games and matchmaker.wait(game, bucket)
+
+        message = " ".join(str(part) for part in ("player", game.id, color, time_control, rating))
+        hand_over(game.worker, message.encode("utf-8") + b"\n" + pending, conn, undo)
+
+    def route_spectator(conn, direction="current", game_id=-1, pending=b""):
+        if direction == "current":
+            game = remote_games.get(game_id) or remote_games.first()
+        else:
+            game = remote_games.step(game_id, forward=direction == "forward")
+        if game is None:
+            print("[SPECTATOR] No games to spectate")
+            conn.close()
+            return
+        hand_over(game.worker, ("spectator " + str(game.id)).encode("utf-8") + b"\n" + pending, conn)
+
+    def send_connection(worker, message, conn, undo):
+        # False if the channel is full; otherwise the connection has been dealt with
+        try:
+            socket.send_fds(channels[worker], [message], [conn.fileno()])
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            print("[ERROR] Could not hand a connection to worker", worker, "-", e)
+            if undo is not None:
+                undo()
+        # the worker gets its own copy of the descriptor, ours can go
         conn.close()
+        return True
+
+    def hand_over(worker, message, conn, undo=None):
+        # undo reverts what the router decided for the connection, should the worker never get it
+        queue = backlog[worker]
+        if not queue and send_connection(worker, message, conn, undo):
+            return
+        if len(queue) >= MAX_HANDOVER_BACKLOG:
+            print("[ERROR] Worker", worker, "is not keeping up, dropping a connection")
+            if undo is not None:
+                undo()
+            conn.close()
+            return
+        queue.append((message, conn, undo))
+        if len(queue) == 1:
+            loop.add_writer(channels[worker].fileno(), flush_backlog, worker)
+
+    def flush_backlog(worker):
+        queue = backlog[worker]
+        while queue and send_connection(worker, *queue[0]):
+            queue.popleft()
+        if not queue:
+            loop.remove_writer(channels[worker].fileno())
 
+    for channel in channels:
+        channel.setblocking(False)
+        loop.add_reader(channel.fileno(), on_report, channel)
 
-while True:
     read_specs()
-    if connections < MAX_CONNECTIONS:
-        conn, addr = s.accept()
-        spec = False
-        g = -1
+    specs_watcher = loop.create_task(watch_specs())
+    listener.setblocking(False)
+    while True:
+        conn, addr = await loop.sock_accept(listener)
         print("[CONNECT] New connection")
 
-        for game in games.keys():
-            if games[game].ready == False:
-                g=game
+        if addr[0] in spectartor_ids:
+            route_spectator(conn)
+        else:
+            loop.create_task(route_player(conn))
 
-        games[g] = Board(8,8)
-        if g == -1:
-            try:
-                g = list(games.keys())[-1]+1
-            except:
-                g = 0
 
-        print("[DATA] Number of Connections:", connections+1)
-        print("[DATA] Number of Games:", len(games))
+def serve_sharded(workers):
+    """
+    Starts a router and worker processes, one per core by default, and routes connections forever.
+    Needs a platform that can pass sockets between processes (socket.send_fds).
+
+    :param workers: The number of worker processes.
+    """
+    channels = []
+    for i in range(workers):
+        router_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        multiprocessing.Process(target=worker_process, args=(worker_end,), daemon=True).start()
+        worker_end.close()
+        channels.append(router_end)
+
+    # exit normally on a plain kill too, so the daemon workers are stopped along with the router
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    listener = socket.create_server((server, port))
+    print("[START] Routing connections to", workers, "workers")
+    asyncio.run(route_connections(listener, channels))
 
-        start_new_thread(threaded_client, (conn,g,spec))
+
+async def main():
+    """
+    Starts the game server and serves connections forever.
+    """
+    read_specs()
+    boards.fill()
+    specs_watcher = asyncio.get_running_loop().create_task(watch_specs())
+    listener = await asyncio.start_server(handle_connection, server, port)
+    print("[START] Waiting for a connection")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online chess game server.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes to shard games across, 0 for one per core (default 1: no sharding)")
+    args = parser.parse_args()
+    if args.workers == 1:
+        asyncio.run(main())
+    else:
+        serve_sharded(args.workers or multiprocessing.cpu_count())
@@ -0,0 +1,106 @@
+'''
+session tokens that let a player whose connection dropped take their seat back
+a token is issued when a player sits down; if their connection drops while the game is on,
+the seat is held for GRACE_SECONDS and a reconnect presenting the token within that time is
+put back in the same game, getting only the delta it missed instead of a new game
+'''
+
+import secrets
+
+GRACE_SECONDS = 30
+RESUME_COMMAND = "resume"
+
+
+def new_token(game_id):
+    """
+    Makes an unguessable token for a seat. It starts with the game ID so a sharded server's
+    router can send the reconnect to the worker hosting the game.
+
+    :param game_id: The ID of the game the seat is in.
+    :return: The token string, without spaces.
+    """
+    return str(game_id) + "." + secrets.token_hex(16)
+
+
+def game_of_token(token):
+    """
+    Reads the game ID a token was issued for.
+
+    :param token: A token made by new_token.
+    :return: The game ID, or None if the token is malformed.
+    """
+    try:
+        return int(token.split(".", 1)[0])
+    except ValueError:
+        return None
+
+
+def resume_request(token, known_version):
+    """
+    Builds the first message of a reconnecting player, in place of a queue request.
+
+    :param token: The session token the server issued.
+    :param known_version: The board version the player last received.
+    :return: The encoded request.
+    """
+    return (RESUME_COMMAND + " " + token + " " + str(known_version)).encode("utf-8")
+
+
+def parse_resume_request(data):
+    """
+    Reads a reconnecting player's request.
+
+    :param data: The payload of the player's first message.
+    :return: A (token, known version) tuple, where the version is None if it could not be
+             read, or None if the message is not a resume request.
+    """
+    parts = data.decode("utf-8", "ignore").split(" ")
+    if parts[0] != RESUME_COMMAND or len(parts) < 2:
+        return None
+    try:
+        known_version = int(parts[2])
+    except (IndexError, ValueError):
+        known_version = None
+    return parts[1], known_version
+
+
+class SessionTable:
+    def __init__(self):
+        """
+        Creates an empty table of the seats players can reconnect to.
+        """
+
+        # token -> (game, player)
+        self.sessions = {}
+
+    def open(self, game, player):
+        """
+        Issues a token for a seated player.
+
+        :param game: The player's game. Needs an id attribute.
+        :param player: The player's per-connection state, kept across reconnects.
+        :return: The token.
+        """
+        token = new_token(game.id)
+        self.sessions[token] = (game, player)
+        return token
+
+    def get(self, token):
+        """
+        Looks up a seat.
+
+        :param token: The token presented by a reconnecting player.
+        :return: A (game, player) tuple, or None if the token is unknown or its game has ended.
+        """
+        return self.sessions.get(token)
+
+    def close(self, token):
+        """
+        Forgets a seat, once its game is over.
+
+        :param token: The seat's token.
+        """
+        self.sessions.pop(token, None)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,80 @@
+'''
+precomputed per-square move tables, built once at import
+squares are numbered row * 8 + col with row 0 being black's back rank, so every rule
+module can walk these tables instead of doing bounds arithmetic per move
+'''
+
+BOARD_SIZE = 8
+NUM_SQUARES = 64
+
+# ray directions, used to index RAYS and RAY_MASKS
+NORTH, SOUTH, WEST, EAST, NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST = range(8)
+DIRECTION_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (NORTH, SOUTH, WEST, EAST)
+BISHOP_DIRECTIONS = (NORTH_WEST, NORTH_EAST, SOUTH_WEST, SOUTH_EAST)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+# square numbers grow along these rays, so the nearest blocker is the lowest set bit
+INCREASING = tuple(dr * BOARD_SIZE + dc > 0 for dr, dc in DIRECTION_STEPS)
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+# white pawns attack towards row 0, black pawns towards row 7
+PAWN_CAPTURE_OFFSETS = (((-1, -1), (-1, 1)), ((1, -1), (1, 1)))
+
+# (row, col) of every square
+COORDS = tuple(divmod(sq, BOARD_SIZE) for sq in range(NUM_SQUARES))
+
+
+def _on_board(row, col):
+    return 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE
+
+
+def _ray(sq, step):
+    """
+    Lists the squares reached by sliding from a square until the edge of the board.
+
+    :param sq: The starting square, not included.
+    :param step: The (row, col) step.
+    :return: A tuple of squares, nearest first.
+    """
+    row, col = COORDS[sq]
+    dr, dc = step
+    squares = []
+    row, col = row + dr, col + dc
+    while _on_board(row, col):
+        squares.append(row * BOARD_SIZE + col)
+        row, col = row + dr, col + dc
+    return tuple(squares)
+
+
+def _targets(offsets):
+    """
+    Lists the squares a leaping piece reaches from every square.
+
+    :param offsets: The (row, col) offsets the piece can jump by.
+    :return: A tuple of 64 tuples of squares.
+    """
+    table = []
+    for row, col in COORDS:
+        table.append(tuple((row + dr) * BOARD_SIZE + col + dc for dr, dc in offsets if _on_board(row + dr, col + dc)))
+    return tuple(table)
+
+
+def _mask(squares):
+    bb = 0
+    for sq in squares:
+        bb |= 1 << sq
+    return bb
+
+
+# RAYS[direction][square] is the tuple of squares along that ray, nearest first
+RAYS = tuple(tuple(_ray(sq, step) for sq in range(NUM_SQUARES)) for step in DIRECTION_STEPS)
+RAY_MASKS = tuple(tuple(_mask(ray) for ray in rays) for rays in RAYS)
+
+KNIGHT_TARGETS = _targets(KNIGHT_OFFSETS)
+KING_TARGETS = _targets(KING_OFFSETS)
+PAWN_CAPTURE_TARGETS = tuple(_targets(offsets) for offsets in PAWN_CAPTURE_OFFSETS)
+
+KNIGHT_MASKS = tuple(_mask(targets) for targets in KNIGHT_TARGETS)
+KING_MASKS = tuple(_mask(targets) for targets in KING_TARGETS)
+PAWN_CAPTURE_MASKS = tuple(tuple(_mask(targets) for targets in table) for table in PAWN_CAPTURE_TARGETS)
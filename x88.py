@@ -0,0 +1,498 @@
+'''
+0x88 mailbox position backend
+the whole position lives in one 128 byte bytearray where square row * 16 + col is on the
+board exactly when (square & 0x88) == 0, so every step off the edge is caught by a single mask
+it implements the same interface as bitboard.Position, so Board can run on either one
+'''
+
+from bitboard import WHITE
+from bitboard import BLACK
+from bitboard import PAWN
+from bitboard import KNIGHT
+from bitboard import BISHOP
+from bitboard import ROOK
+from bitboard import QUEEN
+from bitboard import KING
+from bitboard import NUM_SQUARES
+from bitboard import FULL
+from bitboard import START_FEN
+from bitboard import WHITE_KINGSIDE
+from bitboard import WHITE_QUEENSIDE
+from bitboard import BLACK_KINGSIDE
+from bitboard import BLACK_QUEENSIDE
+from bitboard import CASTLE_MASK
+from bitboard import CASTLE_ROOKS
+from bitboard import PIECE_CODES
+from bitboard import LIGHT_SQUARES
+from bitboard import ZOBRIST_PIECES
+from bitboard import ZOBRIST_SIDE
+from bitboard import ZOBRIST_CASTLING
+from bitboard import ZOBRIST_EP
+from bitboard import encode_move
+from bitboard import move_from
+from bitboard import move_to
+from bitboard import move_promotion
+from bitboard import parse_fen
+from bitboard import format_fen
+
+OFF_BOARD = 0x88
+
+KNIGHT_STEPS = (-33, -31, -18, -14, 14, 18, 31, 33)
+KING_STEPS = (-17, -16, -15, -1, 1, 15, 16, 17)
+BISHOP_STEPS = (-17, -15, 15, 17)
+ROOK_STEPS = (-16, -1, 1, 16)
+SLIDER_STEPS = {BISHOP: BISHOP_STEPS, ROOK: ROOK_STEPS, QUEEN: KING_STEPS}
+# where a pawn of each color has to stand to attack a square
+PAWN_ATTACKER_STEPS = ((15, 17), (-15, -17))
+PAWN_PUSH = (-16, 16)
+
+# conversions between the 64 square numbering used everywhere else and 0x88
+TO_88 = [sq + (sq & 56) for sq in range(NUM_SQUARES)]
+TO_64 = [(s + (s & 7)) >> 1 if not s & OFF_BOARD else -1 for s in range(128)]
+
+
+class MailboxPosition:
+    def __init__(self, fen=START_FEN):
+        """
+        Initializes a position from a FEN string.
+
+        :param fen: The position in Forsyth-Edwards notation. Defaults to the starting position.
+        """
+
+        self.board = bytearray(128)
+        self.kings = [-1, -1]
+        self.turn = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        # undo records: (move, moved code, captured code, captured square, castling, ep, halfmove, zobrist)
+        self.history = []
+        self.zobrist = 0
+        self.set_fen(fen)
+
+    def set_fen(self, fen):
+        """
+        Loads a FEN string into this position, replacing the current contents.
+
+        :param fen: The position in Forsyth-Edwards notation.
+        """
+        self.load_squares(*parse_fen(fen))
+
+    def reset(self):
+        """
+        Returns to the starting position in place, copying it from a ready-made start position.
+        """
+        start = _START_POSITION
+        self.board[:] = start.board
+        self.kings[:] = start.kings
+        self.turn = start.turn
+        self.castling = start.castling
+        self.ep = start.ep
+        self.halfmove = start.halfmove
+        self.fullmove = start.fullmove
+        self.zobrist = start.zobrist
+        self.history.clear()
+
+    def fen(self):
+        """
+        Serializes the position to a FEN string.
+
+        :return: The position in Forsyth-Edwards notation.
+        """
+        return format_fen(self.squares(), self.turn, self.castling, self.ep, self.halfmove, self.fullmove)
+
+    def squares(self):
+        """
+        Lists the piece code of every square.
+
+        :return: A bytearray of 64 codes.
+        """
+        board = self.board
+        return bytearray(board[s] for s in TO_88)
+
+    def load_squares(self, codes, turn, castling, ep, halfmove, fullmove):
+        """
+        Replaces the position with one given as 64 piece codes plus the game state.
+        The undo stack is cleared.
+
+        :param codes: 64 piece codes.
+        :param turn: The side to move.
+        :param castling: The castling rights bitmask.
+        :param ep: The en passant square or -1.
+        :param halfmove: Plies since the last capture or pawn move.
+        :param fullmove: The move number.
+        """
+        self.board = bytearray(128)
+        self.kings = [-1, -1]
+        for sq, code in enumerate(codes):
+            self.board[TO_88[sq]] = code
+            if code and (code & 7) - 1 == KING:
+                self.kings[code >> 3] = TO_88[sq]
+        self.turn = turn
+        self.castling = castling
+        self.ep = ep
+        self.halfmove = halfmove
+        self.fullmove = fullmove
+        self.history = []
+        self.zobrist = self._compute_zobrist()
+
+    def _ep_zobrist(self):
+        if self.ep == -1:
+            return 0
+        pawn = PIECE_CODES[self.turn][PAWN]
+        target = TO_88[self.ep]
+        for step in PAWN_ATTACKER_STEPS[self.turn]:
+            s = target + step
+            if not s & OFF_BOARD and self.board[s] == pawn:
+                return ZOBRIST_EP[self.ep % 8]
+        return 0
+
+    def _compute_zobrist(self):
+        key = ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        if self.turn == BLACK:
+            key ^= ZOBRIST_SIDE
+        for sq, s in enumerate(TO_88):
+            code = self.board[s]
+            if code:
+                key ^= ZOBRIST_PIECES[code >> 3][(code & 7) - 1][sq]
+        return key
+
+    def key(self):
+        """
+        Identifies the position: placement, side to move, castling rights and en passant square.
+
+        :return: The 64-bit Zobrist key, equal to bitboard.Position's for the same position.
+        """
+        return self.zobrist
+
+    def piece_at(self, sq):
+        """
+        Looks up the piece standing on a square.
+
+        :param sq: The square index (0-63).
+        :return: A (color, piece type) tuple, or None if the square is empty.
+        """
+        code = self.board[TO_88[sq]]
+        if not code:
+            return None
+        return code >> 3, (code & 7) - 1
+
+    def king_square(self, color):
+        """
+        Finds the king of the given color.
+
+        :param color: WHITE or BLACK.
+        :return: The king's square index (0-63), or -1 if there is no king.
+        """
+        s = self.kings[color]
+        return -1 if s == -1 else TO_64[s]
+
+    def _attacked(self, s, by):
+        """
+        Scans outwards from a 0x88 square for attackers of one color.
+
+        :param s: The 0x88 target square.
+        :param by: The attacking color.
+        :return: True if the square is attacked.
+        """
+        board = self.board
+        pawn = PIECE_CODES[by][PAWN]
+        for step in PAWN_ATTACKER_STEPS[by]:
+            t = s + step
+            if not t & OFF_BOARD and board[t] == pawn:
+                return True
+        knight = PIECE_CODES[by][KNIGHT]
+        for step in KNIGHT_STEPS:
+            t = s + step
+            if not t & OFF_BOARD and board[t] == knight:
+                return True
+        king = PIECE_CODES[by][KING]
+        queen = PIECE_CODES[by][QUEEN]
+        for steps, slider in ((ROOK_STEPS, PIECE_CODES[by][ROOK]), (BISHOP_STEPS, PIECE_CODES[by][BISHOP])):
+            for step in steps:
+                t = s + step
+                if not t & OFF_BOARD and board[t] == king:
+                    return True
+                while not t & OFF_BOARD:
+                    code = board[t]
+                    if code:
+                        if code == slider or code == queen:
+                            return True
+                        break
+                    t += step
+        return False
+
+    def is_attacked(self, sq, by):
+        """
+        Checks whether a square is attacked by a color.
+
+        :param sq: The target square (0-63).
+        :param by: The attacking color.
+        :return: True if any piece of that color attacks the square.
+        """
+        return self._attacked(TO_88[sq], by)
+
+    def in_check(self, color):
+        """
+        Checks whether a color's king is attacked.
+
+        :param color: WHITE or BLACK.
+        :return: True if the king is in check.
+        """
+        king = self.kings[color]
+        return king != -1 and self._attacked(king, color ^ 1)
+
+    def attack_set(self, color):
+        """
+        Builds the union of every square attacked by a color.
+
+        :param color: WHITE or BLACK.
+        :return: A bitboard of attacked squares.
+        """
+        attacks = 0
+        for sq, s in enumerate(TO_88):
+            if self._attacked(s, color):
+                attacks |= 1 << sq
+        return attacks
+
+    def insufficient_material(self):
+        """
+        Checks whether neither side can possibly deliver mate: bare kings, a single
+        minor piece, or only bishops that all stand on the same square color.
+
+        :return: True if the position is a dead draw.
+        """
+        minors = 0
+        knights = 0
+        bishops = 0
+        for sq, s in enumerate(TO_88):
+            code = self.board[s]
+            if not code:
+                continue
+            ptype = (code & 7) - 1
+            if ptype in (PAWN, ROOK, QUEEN):
+                return False
+            if ptype == KNIGHT:
+                knights += 1
+                minors += 1
+            elif ptype == BISHOP:
+                bishops |= 1 << sq
+                minors += 1
+        if minors <= 1:
+            return True
+        if knights:
+            return False
+        return not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES
+
+    def _pseudo_moves(self, from_mask):
+        """
+        Yields the pseudo-legal moves of the side to move. Castling is already fully checked.
+
+        :param from_mask: Bitboard restricting which origin squares to generate for.
+        """
+        board = self.board
+        us = self.turn
+        them = us ^ 1
+        for sq, s in enumerate(TO_88):
+            code = board[s]
+            if not code or code >> 3 != us or not (from_mask >> sq) & 1:
+                continue
+            ptype = (code & 7) - 1
+
+            if ptype == PAWN:
+                push = PAWN_PUSH[us]
+                t = s + push
+                targets = []
+                if not t & OFF_BOARD and not board[t]:
+                    targets.append(t)
+                    if (s >> 4) == (6 if us == WHITE else 1) and not board[t + push]:
+                        targets.append(t + push)
+                for t in (s + push - 1, s + push + 1):
+                    if t & OFF_BOARD:
+                        continue
+                    if (board[t] and board[t] >> 3 == them) or TO_64[t] == self.ep:
+                        targets.append(t)
+                for t in targets:
+                    if t >> 4 in (0, 7):
+                        for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                            yield encode_move(sq, TO_64[t], promotion)
+                    else:
+                        yield encode_move(sq, TO_64[t])
+
+            elif ptype == KNIGHT or ptype == KING:
+                for step in KNIGHT_STEPS if ptype == KNIGHT else KING_STEPS:
+                    t = s + step
+                    if not t & OFF_BOARD and (not board[t] or board[t] >> 3 == them):
+                        yield encode_move(sq, TO_64[t])
+                if ptype == KING:
+                    yield from self._castling_moves(us, s)
+
+            else:
+                for step in SLIDER_STEPS[ptype]:
+                    t = s + step
+                    while not t & OFF_BOARD:
+                        if board[t]:
+                            if board[t] >> 3 == them:
+                                yield encode_move(sq, TO_64[t])
+                            break
+                        yield encode_move(sq, TO_64[t])
+                        t += step
+
+    def _castling_moves(self, color, king):
+        """
+        Generates castling moves, checking emptiness and that the king never crosses an attacked square.
+
+        :param color: The castling side.
+        :param king: The king's 0x88 square.
+        :return: A list of packed castling moves.
+        """
+        home = 0x70 + 4 if color == WHITE else 4
+        if king != home:
+            return []
+        kingside = WHITE_KINGSIDE if color == WHITE else BLACK_KINGSIDE
+        queenside = WHITE_QUEENSIDE if color == WHITE else BLACK_QUEENSIDE
+        them = color ^ 1
+        board = self.board
+        moves = []
+        if self.castling & (kingside | queenside) and not self._attacked(king, them):
+            if (self.castling & kingside and not board[king + 1] and not board[king + 2]
+                    and not self._attacked(king + 1, them) and not self._attacked(king + 2, them)):
+                moves.append(encode_move(TO_64[king], TO_64[king + 2]))
+            if (self.castling & queenside and not board[king - 1] and not board[king - 2] and not board[king - 3]
+                    and not self._attacked(king - 1, them) and not self._attacked(king - 2, them)):
+                moves.append(encode_move(TO_64[king], TO_64[king - 2]))
+        return moves
+
+    def iter_legal_moves(self, from_mask=FULL):
+        """
+        Lazily yields the strictly legal moves of the side to move by playing each
+        pseudo-legal move and checking the king.
+
+        :param from_mask: Bitboard restricting which origin squares to generate for. Defaults to all.
+        """
+        us = self.turn
+        for move in list(self._pseudo_moves(from_mask)):
+            self.make_move(move)
+            legal = not self.in_check(us)
+            self.unmake_move()
+            if legal:
+                yield move
+
+    def legal_moves(self, from_mask=FULL):
+        """
+        Generates the strictly legal moves of the side to move.
+
+        :param from_mask: Bitboard restricting which origin squares to generate for. Defaults to all.
+        :return: A list of packed moves.
+        """
+        return list(self.iter_legal_moves(from_mask))
+
+    def has_legal_move(self):
+        """
+        Checks whether the side to move has any legal move, stopping at the first one found.
+
+        :return: True if at least one legal move exists.
+        """
+        for _ in self.iter_legal_moves():
+            return True
+        return False
+
+    def make_move(self, move):
+        """
+        Plays a move on the position without any legality check and pushes
+        everything needed to take it back onto the undo stack.
+
+        :param move: The packed move.
+        :return: The list of squares (0-63) whose contents changed.
+        """
+        board = self.board
+        start = move_from(move)
+        end = move_to(move)
+        promotion = move_promotion(move)
+        s = TO_88[start]
+        t = TO_88[end]
+        us = self.turn
+        them = us ^ 1
+        code = board[s]
+        ptype = (code & 7) - 1
+        changed = [start, end]
+
+        captured_sq = t
+        if ptype == PAWN and end == self.ep:
+            captured_sq = t - PAWN_PUSH[us]
+            changed.append(TO_64[captured_sq])
+        captured = board[captured_sq]
+
+        self.history.append((move, code, captured, captured_sq, self.castling, self.ep, self.halfmove, self.zobrist))
+        zobrist = self.zobrist ^ ZOBRIST_SIDE ^ ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        table = ZOBRIST_PIECES[us]
+
+        if captured:
+            board[captured_sq] = 0
+            zobrist ^= ZOBRIST_PIECES[them][(captured & 7) - 1][TO_64[captured_sq]]
+
+        moved = PIECE_CODES[us][promotion] if promotion else code
+        board[s] = 0
+        board[t] = moved
+        zobrist ^= table[ptype][start] ^ table[(moved & 7) - 1][end]
+
+        if ptype == KING:
+            self.kings[us] = t
+            if abs(end - start) == 2:
+                rook_from, rook_to = CASTLE_ROOKS[end]
+                board[TO_88[rook_from]] = 0
+                board[TO_88[rook_to]] = PIECE_CODES[us][ROOK]
+                changed.extend((rook_from, rook_to))
+                zobrist ^= table[ROOK][rook_from] ^ table[ROOK][rook_to]
+
+        self.castling &= CASTLE_MASK[start] & CASTLE_MASK[end]
+        self.ep = (start + end) // 2 if ptype == PAWN and abs(t - s) == 32 else -1
+        if ptype == PAWN or captured:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if us == BLACK:
+            self.fullmove += 1
+        self.turn = them
+        self.zobrist = zobrist ^ ZOBRIST_CASTLING[self.castling] ^ self._ep_zobrist()
+        return changed
+
+    def unmake_move(self):
+        """
+        Takes back the last move played with make_move.
+
+        :return: The list of squares (0-63) whose contents changed.
+        """
+        move, code, captured, captured_sq, self.castling, self.ep, self.halfmove, self.zobrist = self.history.pop()
+        board = self.board
+        start = move_from(move)
+        end = move_to(move)
+        s = TO_88[start]
+        t = TO_88[end]
+        self.turn ^= 1
+        us = self.turn
+        changed = [start, end]
+
+        board[t] = 0
+        board[s] = code
+        if captured:
+            board[captured_sq] = captured
+            if captured_sq != t:
+                changed.append(TO_64[captured_sq])
+
+        if (code & 7) - 1 == KING:
+            self.kings[us] = s
+            if abs(end - start) == 2:
+                rook_from, rook_to = CASTLE_ROOKS[end]
+                board[TO_88[rook_to]] = 0
+                board[TO_88[rook_from]] = PIECE_CODES[us][ROOK]
+                changed.extend((rook_from, rook_to))
+
+        if us == BLACK:
+            self.fullmove -= 1
+        return changed
+
+
+# copied by MailboxPosition.reset, never modified
+_START_POSITION = MailboxPosition()